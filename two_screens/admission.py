@@ -0,0 +1,184 @@
+"""
+Допуск новых агентов (/process): лимиты и очередь запусков.
+
+Без лимита всплеск пользователей запускает сколько угодно агентов и выбирает
+воркеры планировщика и соединения БД. AdmissionControl ограничивает число агентов
+процесса (max_agents) и сессии (per_session). Сверх лимита процесса запуски ждут
+в очереди (max_pending), задача при этом уже создана со статусом «в черзі»
+и держит аренду (её место в общей очереди узлов страница статуса берёт из БД). Когда переполнена и очередь, или
+исчерпан лимит сессии, /process сразу отвечает 429 с Retry-After, не трогая БД.
+
+Сам агентов не запускает: reserve()/commit() и release() говорят, какие задачи
+запускать сейчас, приложение запускает их (планировщик в app.py, задачи asyncio
+в asgi_app.py) и сообщает started().
+"""
+import threading
+from collections import OrderedDict
+
+
+class Overloaded(Exception):
+    """Запуск отклонён: reason – что переполнено, retry_after – через сколько секунд повторить."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Reservation:
+    """Место, занятое reserve() до создания задачи в БД."""
+
+    __slots__ = ("session_id", "queued")
+
+    def __init__(self, session_id, queued):
+        self.session_id = session_id
+        self.queued = queued
+
+
+class AdmissionControl:
+    """
+      running     – running() -> int: сколько агентов уже работает в процессе
+                    (включая возобновлённых по арендам);
+      max_agents  – лимит агентов процесса;
+      per_session – лимит работающих и ожидающих агентов одной сессии;
+      max_pending – длина очереди запусков;
+      retry_after – Retry-After для отказа, сек.
+    """
+
+    def __init__(self, running, max_agents=1000, per_session=5, max_pending=100, retry_after=5):
+        self._running = running
+        self.max_agents = max_agents
+        self.per_session = per_session
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._sessions = {}           # session_id -> {task_id или Reservation}
+        self._owners = {}             # task_id -> session_id
+        self._pending = OrderedDict()  # task_id -> None, в порядке очереди
+        self._starting = set()        # task_id, которым отдано место, но агент ещё не запущен
+        self._reserved = 0            # reserve() без commit(), которые запустятся сразу
+        self._reserved_pending = 0    # reserve() без commit(), которые встанут в очередь
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+
+    def reserve(self, session_id):
+        """Место для нового агента сессии или Overloaded. Затем commit() или cancel()."""
+        with self._lock:
+            owned = self._sessions.get(session_id, ())
+            if len(owned) >= self.per_session:
+                self.rejected += 1
+                raise Overloaded(f"У сесії вже {len(owned)} агентів (ліміт {self.per_session})", self.retry_after)
+            # Очередь обслуживается по порядку: пока она не пуста, новые запуски – в её конец
+            queued = bool(self._pending) or self._reserved_pending > 0 or self._free() <= 0
+            if queued:
+                if len(self._pending) + self._reserved_pending >= self.max_pending:
+                    self.rejected += 1
+                    raise Overloaded(f"Черга запусків заповнена ({self.max_pending})", self.retry_after)
+                self._reserved_pending += 1
+            else:
+                self._reserved += 1
+            reservation = Reservation(session_id, queued)
+            self._sessions.setdefault(session_id, set()).add(reservation)
+            return reservation
+
+    def commit(self, reservation, task_id):
+        """Задача создана. 0 – запускать сейчас (затем started()), иначе место в очереди (с 1)."""
+        with self._lock:
+            self._unreserve(reservation)
+            self._sessions.setdefault(reservation.session_id, set()).add(task_id)
+            self._owners[task_id] = reservation.session_id
+            if not reservation.queued:
+                self._starting.add(task_id)
+                self.admitted += 1
+                return 0
+            self._pending[task_id] = None
+            self.queued += 1
+            return len(self._pending)
+
+    def cancel(self, reservation):
+        """Задачу создать не удалось – место освобождается."""
+        with self._lock:
+            self._unreserve(reservation)
+            owned = self._sessions.get(reservation.session_id)
+            if owned is not None and not owned:
+                del self._sessions[reservation.session_id]
+
+    def started(self, task_id):
+        """Агент запущен и теперь учитывается в running()."""
+        with self._lock:
+            self._starting.discard(task_id)
+
+    def release(self, task_id):
+        """
+        Агент снят (остановлен, завершён, не запустился) или удалён из очереди.
+        Возвращает задачи из очереди, которые теперь можно запускать (для каждой – started()
+        или, если запуск не удался, release()).
+        """
+        with self._lock:
+            session_id = self._owners.pop(task_id, None)
+            if session_id is not None:
+                owned = self._sessions.get(session_id)
+                if owned is not None:
+                    owned.discard(task_id)
+                    if not owned:
+                        del self._sessions[session_id]
+            self._pending.pop(task_id, None)
+            self._starting.discard(task_id)
+            return self._drain()
+
+    def drain(self):
+        """Задачи из очереди, для которых уже есть место (после commit() в очередь)."""
+        with self._lock:
+            return self._drain()
+
+    def waiting(self):
+        """Агенты, которым место уже обещано: очередь и ещё не запущенные."""
+        with self._lock:
+            return len(self._pending) + len(self._starting) + self._reserved + self._reserved_pending
+
+    def close(self):
+        """Остановка процесса: очередь больше не обслуживается, их аренды заберут другие узлы."""
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+            return pending
+
+    def _drain(self):
+        ready = []
+        while self._pending and self._free() > 0:
+            task_id, _ = self._pending.popitem(last=False)
+            self._starting.add(task_id)
+            ready.append(task_id)
+        self.admitted += len(ready)
+        return ready
+
+    def _free(self):
+        return self.max_agents - self._running() - len(self._starting) - self._reserved
+
+    def _unreserve(self, reservation):
+        owned = self._sessions.get(reservation.session_id)
+        if owned is None or reservation not in owned:
+            return
+        owned.discard(reservation)
+        if reservation.queued:
+            self._reserved_pending -= 1
+        else:
+            self._reserved -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._running(),
+                "max_agents": self.max_agents,
+                "per_session": self.per_session,
+                "pending": len(self._pending),
+                "max_pending": self.max_pending,
+                "starting": len(self._starting),
+                "sessions": len(self._sessions),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,350 @@
+"""
+Агенты узла: запуск, возобновление по арендам, очередь запусков, остановка и чтение статуса.
+
+Логика общая для app.py (потоки, AgentScheduler) и asgi_app.py (задачи asyncio).
+Методы AgentNode, которым нужна БД, – генераторы («потоки» операций): вызов хранилища
+отдаётся наружу шагом StorageCall, результат (или исключение) возвращается в генератор.
+Выполняют их run_flow() (синхронное storage) и arun_flow() (async_storage);
+сами методы ничего не ждут.
+Чем агент тикает, решает приложение: AgentNode получает
+  start_agent(task_id, state=None, delay=0.0) – поставить агента на узел (state – уже
+      загруженное состояние, delay – задержка первого тика);
+  stop_agent(task_id) -> bool – снять агента; False, если он не работал (тогда уборку
+      делает сам AgentNode, иначе приложение вызывает agent_removed(), когда агент остановится);
+  is_running(task_id) -> bool.
+"""
+from collections import namedtuple
+from datetime import datetime
+
+from etags import make_etag
+from simulator import (
+    TRADE_FEE, agent_state, apply_trade, catch_up_times, generate_agent_name, new_agent_seed, trade_time,
+)
+from status_cache import snapshot_view
+from status_view import build_snapshot, format_log, from_ms, merge_pending, status_payload, to_ms, trade_event
+from storage import QUEUED_STATUS, RUNNING_STATUS, STOPPED_STATUS, StorageUnavailable
+from write_buffer import BufferFull
+
+FINISH_TEXT = "Результат: агент завершил работу"
+
+# Шаг потока: метод хранилища и его аргументы
+StorageCall = namedtuple("StorageCall", "method args")
+
+
+def call(method, *args):
+    return StorageCall(method, args)
+
+
+def run_flow(storage, flow):
+    """Выполняет поток AgentNode на синхронном хранилище; возвращает его результат."""
+    result, error = None, None
+    while True:
+        try:
+            step = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            result = getattr(storage, step.method)(*step.args)
+        except Exception as e:
+            error = e
+
+
+async def arun_flow(storage, flow):
+    """Как run_flow(), на асинхронном хранилище (async_storage)."""
+    result, error = None, None
+    while True:
+        try:
+            step = flow.send(result) if error is None else flow.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            result = await getattr(storage, step.method)(*step.args)
+        except Exception as e:
+            error = e
+
+
+class AgentNode:
+    """
+      status_cache, status_broker, trade_writer, admission, lease_keeper – компоненты приложения;
+      node_id          – имя узла в agent_leases;
+      interval         – интервал тика агента, сек;
+      resume_catch_up  – сколько пропущенных тиков догонять при возобновлении;
+      start_agent, stop_agent, is_running – см. модуль.
+    """
+
+    def __init__(self, status_cache, status_broker, trade_writer, admission, lease_keeper, node_id,
+                 interval, resume_catch_up, start_agent, stop_agent, is_running):
+        self.status_cache = status_cache
+        self.status_broker = status_broker
+        self.trade_writer = trade_writer
+        self.admission = admission
+        self.lease_keeper = lease_keeper
+        self.node_id = node_id
+        self.interval = interval
+        self.resume_catch_up = resume_catch_up
+        self.start_agent = start_agent
+        self.stop_agent = stop_agent
+        self.is_running = is_running
+
+    # --- тики ---
+
+    def record_trade(self, task_id, state, log_time=None):
+        """
+        Сделка агента (сейчас или в момент пропущенного тика log_time) – в буфер, кэш и SSE.
+        BufferFull – буфер записи переполнен, сделка не сделана.
+        """
+        # Следующая сделка из детерминированного потока агента
+        engine = state["engine"]
+        log_time, symbol, side, amount, change_pnl = engine.step([log_time or trade_time()])[0]
+
+        # В буфер: trade_logs и pnl/fee в tasks запишутся пачкой
+        try:
+            self.trade_writer.add(task_id, log_time, symbol, side, amount, change_pnl, TRADE_FEE)
+        except BufferFull:
+            engine.position -= 1  # сделка не записана – следующий тик повторит её
+            raise
+        apply_trade(state, change_pnl)
+
+        # Write-through в кэш статуса и дельта для открытых дашбордов (SSE)
+        t_ms = to_ms(log_time)
+        log = format_log({"log_time": log_time, "symbol": symbol, "side": side,
+                          "amount": amount, "pnl_change": change_pnl})
+        self.status_cache.apply_trade(task_id, t_ms, log, state["pnl"], state["total_fee"])
+        if self.status_broker.has_subscribers(task_id):
+            self.status_broker.publish(task_id, trade_event(state, t_ms, log))
+
+    def load_agent(self, task_id):
+        """Состояние агента для первого тика; None – агент не нужен (задачи нет, остановлена, БД недоступна)."""
+        try:
+            row = yield call("get_agent", task_id)
+        except StorageUnavailable:
+            yield from self.finish_simulation(task_id)
+            return None
+        if not row or row["status"] == STOPPED_STATUS:
+            yield from self.release_lease(task_id)
+            return None
+        return agent_state(row, task_id)
+
+    def finish_simulation(self, task_id):
+        """Если задача не остановлена, меняем статус на “Результат: ...”"""
+        try:
+            if (yield call("finish_task", task_id, FINISH_TEXT)):
+                self.status_cache.set_status(task_id, FINISH_TEXT)
+        except StorageUnavailable:
+            pass
+        yield from self.release_lease(task_id)
+
+    def release_lease(self, task_id):
+        """Задача больше не выполняется: аренду не должен забрать ни один узел."""
+        try:
+            yield call("release_lease", task_id)
+        except StorageUnavailable:
+            pass
+
+    # --- запуск и остановка ---
+
+    def create_agent(self, reservation, number, slider_value, period):
+        """
+        Новая задача по месту reservation (admission.reserve()): запись в БД, аренда,
+        запуск или очередь. Возвращает (task_id, место в очереди или None).
+        StorageUnavailable – место возвращено в admission.
+        """
+        added = []
+
+        def on_created(task_id):
+            # До COMMIT: продление не должно увидеть аренду раньше LeaseKeeper и запустить
+            # задачу из очереди как забранную, мимо admission
+            self.lease_keeper.add(task_id)
+            added.append(task_id)
+
+        try:
+            # Аренда – в той же транзакции, и у ждущего запуска: упадёт процесс – задачу
+            # заберёт и запустит другой узел
+            task_id = yield call("create_task", number, slider_value, period,
+                                 QUEUED_STATUS if reservation.queued else RUNNING_STATUS,
+                                 generate_agent_name(), datetime.now(), new_agent_seed(),
+                                 self.node_id, self.lease_keeper.ttl, on_created)
+        except Exception:
+            for task_id in added:
+                self.lease_keeper.discard(task_id)
+            self.admission.cancel(reservation)
+            raise
+        position = self.admission.commit(reservation, task_id)
+
+        if position:
+            # Ждёт места; оно могло освободиться, пока создавалась задача
+            yield from self.start_queued(self.admission.drain())
+        else:
+            # Агент работает на этом узле: аренда уже наша, первый тик – сразу
+            self.start_agent(task_id)
+            self.admission.started(task_id)
+        return task_id, position
+
+    def resume_agents(self, task_ids):
+        """
+        Агенты, чьи аренды узел только что получил (рестарт, падение соседнего узла).
+        Состояние – одним запросом на пачку; пропущенные за простой тики догоняются,
+        но не больше resume_catch_up сделок на агента; первые тики пачки
+        размазаны по интервалу тика, чтобы не бить в базу одновременно.
+        """
+        try:
+            rows = yield call("get_agents", task_ids)
+        except StorageUnavailable:
+            rows = {}  # состояние загрузит первый тик
+        now = datetime.now()
+        for i, task_id in enumerate(task_ids):
+            if self.is_running(task_id):
+                continue
+            row = rows.get(task_id)
+            state = None
+            if row is not None:
+                if row["status"] == STOPPED_STATUS:
+                    yield from self.release_lease(task_id)
+                    self.discard_lease(task_id)
+                    continue
+                queued = row["status"] == QUEUED_STATUS
+                if queued and not (yield from self.start_claimed(task_id)):
+                    continue
+                state = agent_state(row, task_id)
+                if queued:
+                    # Запуск ждал в очереди другого узла – пропущенных тиков у него нет
+                    state["status"] = RUNNING_STATUS
+                else:
+                    last_time = row["last_time"] or row["start_time"]
+                    try:
+                        for log_time in catch_up_times(last_time, now, self.interval, self.resume_catch_up):
+                            self.record_trade(task_id, state, log_time)
+                    except BufferFull as e:
+                        print(f"Пропущенные тики агента {task_id} не догнаны: {e}")
+            self.start_agent(task_id, state, self.interval * i / len(task_ids))
+
+    def start_claimed(self, task_id):
+        """
+        Задача ждала в очереди узла, который упал или остановился, и её аренду забрал этот узел:
+        место здесь есть (захват ограничен capacity), запускаем сразу. False – запускать не нужно.
+        """
+        try:
+            started = yield call("start_queued", task_id)
+        except StorageUnavailable:
+            # Аренда осталась нашей: при следующем продлении задача снова придёт в resume_agents
+            self.discard_lease(task_id)
+            return False
+        if not started:
+            # Остановлена, пока ждала
+            yield from self.release_lease(task_id)
+            self.discard_lease(task_id)
+            return False
+        self.status_broker.publish(task_id, {"type": "status", "status": RUNNING_STATUS})
+        return True
+
+    def start_queued(self, task_ids):
+        """
+        Запуски, дождавшиеся места в очереди admission: статус «в обробці», запуск агента.
+        Аренду задача держит с момента постановки в очередь.
+        """
+        task_ids = list(task_ids)
+        while task_ids:
+            task_id = task_ids.pop(0)
+            try:
+                started = yield call("start_queued", task_id)
+            except StorageUnavailable:
+                yield from self.finish_simulation(task_id)
+                started = False
+            if not started:
+                # Остановлена, пока ждала, или БД недоступна – место отдаём следующему
+                yield from self.release_lease(task_id)
+                self.discard_lease(task_id)
+                self.status_cache.discard(task_id)
+                task_ids += self.admission.release(task_id)
+                continue
+            self.status_cache.set_status(task_id, RUNNING_STATUS)
+            self.status_broker.publish(task_id, {"type": "status", "status": RUNNING_STATUS})
+            self.start_agent(task_id)
+            self.admission.started(task_id)
+
+    def discard_lease(self, task_id):
+        """
+        Аренду больше не отслеживаем. Агент, если он всё же стоит на узле, снимается:
+        без аренды он только пропускал бы тики, занимая место в расписании.
+        """
+        self.lease_keeper.discard(task_id)
+        self.stop_agent(task_id)
+
+    def agent_removed(self, task_id):
+        """Агент ушёл с узла (остановлен, аренда потеряна): место – следующему в очереди."""
+        self.lease_keeper.discard(task_id)
+        self.status_cache.discard(task_id)
+        yield from self.start_queued(self.admission.release(task_id))
+
+    def drop_agent(self, task_id):
+        """Аренда у другого узла или снята: агент (или его запуск, ждущий в очереди) уходит с узла."""
+        if not self.stop_agent(task_id):
+            yield from self.agent_removed(task_id)
+
+    def stop_task(self, task_id):
+        """
+        /stop: статус «зупинено», аренда снята, агент снят с узла сразу – следующего тика не будет.
+        Если агент работает на другом узле, тот узнает об остановке по снятой аренде.
+        """
+        try:
+            yield call("set_status", task_id, STOPPED_STATUS)
+            yield call("release_lease", task_id)
+        except StorageUnavailable:
+            pass
+        yield from self.drop_agent(task_id)
+        self.status_cache.set_status(task_id, STOPPED_STATUS)
+        self.status_broker.publish(task_id, {"type": "status", "status": STOPPED_STATUS})
+
+    # --- страница статуса ---
+
+    def status_data(self, task_id, since, max_points, seen):
+        """
+        Ответ /status_data: (ETag, JSON) или (ETag, None), если клиент этот ответ уже видел
+        (seen(tag) – If-None-Match); None, если задачи нет. Горячие задачи – из status_cache
+        без БД. Кэш верен только для агентов этого узла: остальные пишут в БД мимо него.
+        """
+        # Версия задачи – из кэша или одним дешёвым запросом; если клиент уже видел
+        # этот ответ, снимок не читаем и JSON не сериализуем
+        local = self.lease_keeper.holds(task_id)
+        version = self.status_cache.version(task_id) if local else None
+        if version is None:
+            version = yield call("task_version", task_id)
+            if version is None:
+                return None
+        tag = make_etag(task_id, since, max_points, version)
+        if seen(tag):
+            return tag, None
+
+        snapshot = self.status_cache.snapshot(task_id, since) if local else None
+        if snapshot is None:
+            snapshot = yield from self.read_status_snapshot(task_id, since, cache=local)
+            if snapshot is None:
+                return None
+        return tag, status_payload(snapshot, since, max_points)
+
+    def read_status_snapshot(self, task_id, since=None, cache=True):
+        """
+        Читает состояние задачи из хранилища (при промахе кэша).
+        С cache задача читается целиком и кладётся в status_cache – и при опросе по since,
+        иначе после первой загрузки кэш так и не заполнился бы. Несохранённые сделки задачи
+        берутся из буфера записи (в БД их ещё нет). Если ряд не помещается в кэш или пачка
+        как раз пишется, читаем только нужное (since), а заполнить кэш попробует следующий промах.
+        Возвращает None, если задачи нет.
+        """
+        token = self.status_cache.begin_load(task_id)
+        pending = self.trade_writer.pending_rows(task_id) if cache and self.status_cache.fits(task_id) else None
+        data = yield call("load_status", task_id, from_ms(since) if since is not None and pending is None else None)
+        if data is None:
+            return None
+        if pending is None:
+            return build_snapshot(data, since)[0]
+        seq, rows = pending
+        # Пачка записалась во время чтения: часть rows уже в data – отдаём снимок БД как есть, без кэша
+        consistent = not self.trade_writer.written_since(seq)
+        snapshot, cache_entry = build_snapshot(merge_pending(data, rows) if consistent else data)
+        if consistent:
+            # Сделки после begin_load() сменили поколение – load() такой снимок не примет
+            self.status_cache.load(task_id, token, *cache_entry)
+        return snapshot if since is None else snapshot_view(*cache_entry, since)
@@ -1,186 +1,275 @@
+import atexit
 import os
-import time
+import secrets
+import socket
 import threading
-import random
-from datetime import datetime
-import pymysql
-from flask import Flask, request, jsonify, render_template, url_for, redirect, session
+from datetime import datetime, timedelta
+from flask import Flask, Response, g, request, jsonify, render_template, url_for, redirect, session, stream_with_context
+
+from admission import AdmissionControl, Overloaded
+from agent_node import AgentNode, run_flow
+from chart_data import ResponseCache, chart_payload, parse_chart_args
+from etags import make_etag, not_modified, with_etag
+from events import EventBroker, format_sse
+from export import EXPORT_FORMATS, export_filename, format_chunks, parse_export_args
+from fast_json import OrjsonProvider, compress_response
+from leases import LeaseKeeper
+from metrics import create_metrics
+from query_stats import QueryStats
+from rollups import candle_range
+from scheduler import AgentScheduler
+from status_cache import StatusCache
+from status_view import candles_payload, from_ms, parse_max_points
+from storage import StorageUnavailable, create_storage, query_listeners
+from write_buffer import TradeWriteBuffer
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # В реальном проекте используйте переменные окружения
+# jsonify через orjson (если установлен) – крупные ряды [t_ms, pnl] сериализуются в разы быстрее
+app.json = OrjsonProvider(app)
 
-# Конфигурация подключения к MySQL
-DATABASE_CONFIG = {
-    'host': 'ub469996.mysql.tools',
-    'user': 'ub469996_twoscreens',
-    'password': '&;NeLfg295',
-    'database': 'ub469996_twoscreens',
-    'charset': 'utf8mb4',
-    'cursorclass': pymysql.cursors.DictCursor
-}
-
-def get_db_connection():
-    """Создаёт и возвращает подключение к MySQL с использованием PyMySQL."""
-    try:
-        connection = pymysql.connect(**DATABASE_CONFIG)
-        return connection
-    except Exception as e:
-        print(f"Ошибка подключения к MySQL: {e}")
-        return None
+# Хранилище: MySQL (по умолчанию) или SQLite, см. storage.create_storage()
+storage = create_storage()
+
+# 0 – миграции выполняются отдельным шагом деплоя (python migrations.py), процесс только проверяет схему
+DB_MIGRATE_ON_START = os.getenv("DB_MIGRATE_ON_START", "1") != "0"
 
 def init_db():
     """
-    Инициализация БД:
-      1. Создаём таблицу tasks (если её нет) c полями для agent_name, start_time, pnl, total_fee.
-      2. Создаём таблицу trade_logs (если её нет) для хранения лога сделок.
+    Инициализация БД: применяем версионные миграции из migrations.py
+    (таблицы tasks, trade_logs и индексы) и проверяем планы горячих запросов.
+    Ошибка прерывает запуск: воркер на недомигрированной схеме ломает /process и /status_data.
     """
-    conn = get_db_connection()
-    if not conn:
-        print("Не удалось подключиться к БД при инициализации.")
-        return
     try:
-        cursor = conn.cursor()
-        # Создаём таблицу tasks
-        create_tasks_query = """
-        CREATE TABLE IF NOT EXISTS tasks (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            number INT,
-            slider_value DECIMAL(10,2),
-            period VARCHAR(50),
-            status VARCHAR(255),
-            agent_name VARCHAR(50),
-            start_time DATETIME,
-            pnl DECIMAL(10,2) DEFAULT 0,
-            total_fee DECIMAL(10,2) DEFAULT 0
-        ) ENGINE=InnoDB;
-        """
-        cursor.execute(create_tasks_query)
-
-        # Создаём таблицу trade_logs
-        create_trade_logs_query = """
-        CREATE TABLE IF NOT EXISTS trade_logs (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            task_id INT,
-            log_time DATETIME,
-            symbol VARCHAR(20),
-            side VARCHAR(10),
-            amount DECIMAL(10,2),
-            pnl_change DECIMAL(10,2)
-        ) ENGINE=InnoDB;
-        """
-        cursor.execute(create_trade_logs_query)
-
-        conn.commit()
-        cursor.close()
-    except Exception as e:
-        print("Ошибка при создании таблиц:", e)
-    finally:
-        conn.close()
+        problems = storage.init_schema(migrate=DB_MIGRATE_ON_START)
+    except StorageUnavailable:
+        print("Не удалось подключиться к БД при инициализации.")
+        raise
+    for problem in problems:
+        print("Предупреждение (план запроса):", problem)
 
 init_db()
 
+# Метрики для Prometheus: задержки по маршрутам, SQL на запрос, активные агенты (/metrics)
+metrics = create_metrics()
+query_listeners.append(metrics.on_query)
+
+# Статистика по нормализованным SQL и лог запросов дольше SLOW_QUERY_MS (/query_stats)
+query_stats = QueryStats(slow_threshold=float(os.getenv("SLOW_QUERY_MS", "200")) / 1000)
+query_listeners.append(query_stats.on_query)
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started = metrics.begin_request()
+
+@app.after_request
+def finish_request_metrics(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        # Шаблон маршрута, а не путь: /status_data/<int:task_id> – одна серия на все задачи
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.end_request(started, route, request.method, response.status_code)
+    return response
+
+@app.after_request
+def compress(response):
+    """gzip/brotli для JSON и HTML крупнее fast_json.COMPRESS_MIN_SIZE (Telegram WebApp на мобильных)."""
+    return compress_response(response, request.accept_encodings)
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/pool_stats", methods=["GET"])
+def pool_stats():
+    """Статистика соединений хранилища (in_use, idle, время ожидания) для подбора размеров пула."""
+    return jsonify(storage.stats())
+
+# Агрегаты /chart_data по всем задачам: кэш на CHART_CACHE_TTL секунд
+chart_cache = ResponseCache(ttl=float(os.getenv("CHART_CACHE_TTL", "10")))
+
 @app.route("/chart_data", methods=["GET"])
 def chart_data():
     """
-    Возвращает список всех PnL из таблицы tasks, например [12.5, -1.0, 7.2, ...].
-    Или любой другой формат (например, [{x:1,y:12.5}, ...]).
+    PnL задач для графика на странице input (см. chart_data.py):
+    по умолчанию – массив не длиннее max_points (500) средних PnL групп задач по id,
+    например [12.5, -1.0, 7.2, ...]; mode=histogram – распределение PnL,
+    mode=page – строки задач с курсором after_id; from/to – окно по времени старта.
     """
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "DB connection failed"}), 500
     try:
-        cursor = conn.cursor()
-        # Допустим, хотим получить все PnL из tasks,
-        # упорядочим по id (или start_time), как вам удобнее.
-        cursor.execute("SELECT pnl FROM tasks ORDER BY id ASC")
-        rows = cursor.fetchall()
-        cursor.close()
-    finally:
-        conn.close()
-
-    # Превратим в массив значений
-    # rows будет списком словарей [{'pnl': 12.3}, ...]
-    pnl_list = []
-    for row in rows:
-        pnl_value = float(row["pnl"]) if row["pnl"] else 0.0
-        pnl_list.append(pnl_value)
-
-    return jsonify(pnl_list)
-def generate_agent_name():
+        query = parse_chart_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    cached = chart_cache.get(query)
+    if cached is None:
+        try:
+            payload = chart_payload(query, storage.chart_data(query))
+        except StorageUnavailable:
+            return jsonify({"error": "DB connection failed"}), 500
+        cached = (payload, make_etag(query, payload))
+        chart_cache.put(query, cached)
+    payload, tag = cached
+    if request.if_none_match.contains_weak(tag):
+        return not_modified(Response, tag)
+    return with_etag(jsonify(payload), tag)
+
+def simulate_trading(task_id):
     """
-    Генерирует псевдослучайное имя агента, например 'Gosha#187654'.
+    Один тик симуляции агента (вызывается планировщиком каждые AGENT_TICK_SECONDS сек).
+    Возвращает False, когда агента нужно снять с расписания (задача удалена или остановлена).
+    Сделка не пишется в БД напрямую, а уходит в trade_writer (write-behind).
     """
-    possible_names = ["Gosha", "Slavik", "Nikolya", "Alexa", "Jenya", "Sergio", "Ivan", "Oleg", "Sasha"]
-    name = random.choice(possible_names)
-    number = random.randint(10000, 99999)
-    return f"{name}#{number}"
+    if not lease_keeper.holds(task_id):
+        # Аренда не подтверждена базой (или уже у другого узла) – тик пропускаем
+        return True
+    # Состояние агента загружаем из БД один раз, при первом тике (или пачкой в resume_agents).
+    # Дальше статус не опрашиваем: stop_task снимает агента с расписания напрямую.
+    state = agent_states.get(task_id)
+    if state is None:
+        state = run_flow(storage, node.load_agent(task_id))
+        if state is None:
+            return False
+        agent_states[task_id] = state
+    elif not scheduler.is_running(task_id):
+        # stop_task пришёл, пока тик ждал воркера
+        return False
+
+    node.record_trade(task_id, state)
+    return True
+
+def start_agent(task_id, state=None, delay=None):
+    """Агент – в расписание планировщика; state – уже загруженное состояние (resume_agents)."""
+    if state is not None:
+        agent_states[task_id] = state
+    scheduler.add(task_id, delay=delay)
+
+# Подписчики SSE-потоков статуса: симулятор публикует дельты, клиенты получают их без опроса БД
+status_broker = EventBroker(queue_size=int(os.getenv("SSE_QUEUE_SIZE", "100")))
+SSE_KEEPALIVE_SECONDS = 15
+# Агент на другом узле: дельт в этот процесс не приходит, поток сверяет версию задачи в БД
+SSE_REMOTE_POLL_SECONDS = 5
+
+# Кэш состояния задач для /status_data (write-through из симулятора и stop_task)
+status_cache = StatusCache(
+    max_tasks=int(os.getenv("STATUS_CACHE_TASKS", "1000")),
+    ttl=int(os.getenv("STATUS_CACHE_TTL", "300")),
+    max_points=int(os.getenv("STATUS_CACHE_MAX_POINTS", "50000")),
+)
+
+# Write-behind запись сделок: многострочные INSERT и агрегированные UPDATE раз в flush_interval
+trade_writer = TradeWriteBuffer(
+    storage.write_trades,
+    flush_interval=float(os.getenv("TRADE_FLUSH_SECONDS", "1")),
+    batch_size=int(os.getenv("TRADE_FLUSH_BATCH", "1000")),
+    max_pending=int(os.getenv("TRADE_MAX_PENDING", "20000")),
+    on_flush=status_cache.invalidate_loads,
+)
+
+# Состояние запущенных агентов (task_id -> dict), обновляется только тиком своего агента;
+# удаляется планировщиком, когда агент снят с расписания
+agent_states = {}
+
+def remove_agent(task_id):
+    agent_states.pop(task_id, None)
+    run_flow(storage, node.agent_removed(task_id))
+
+def drop_agent(task_id):
+    """Аренда у другого узла или снята: агент (или его запуск, ждущий в очереди) уходит с узла."""
+    run_flow(storage, node.drop_agent(task_id))
+
+# Один планировщик на все агенты: куча дедлайнов + небольшой пул воркеров
+scheduler = AgentScheduler(
+    simulate_trading,
+    interval=float(os.getenv("AGENT_TICK_SECONDS", "5")),
+    workers=int(os.getenv("AGENT_WORKERS", "8")),
+    on_remove=remove_agent,
+)
+
+# Допуск новых агентов (см. admission.py): лимит процесса – тот же AGENT_NODE_CAPACITY, что у аренд,
+# лимит сессии и очередь запусков; сверх них /process сразу отвечает 429 с Retry-After
+NODE_CAPACITY = int(os.getenv("AGENT_NODE_CAPACITY", "1000"))
+admission = AdmissionControl(
+    scheduler.running,
+    max_agents=NODE_CAPACITY,
+    per_session=int(os.getenv("AGENT_SESSION_LIMIT", "5")),
+    max_pending=int(os.getenv("AGENT_START_QUEUE", "100")),
+    retry_after=int(os.getenv("AGENT_RETRY_AFTER", "5")),
+)
+
+# Аренды агентов в БД: агент тикает только на узле, который держит аренду; узлы забирают
+# просроченные аренды упавших соседей и свои после рестарта (resume_agents).
+# NODE_ID – имя узла (к нему добавляется pid воркера)
+NODE_ID = f"{os.getenv('NODE_ID', socket.gethostname())}:{os.getpid()}"
+RESUME_MAX_CATCHUP = int(os.getenv("AGENT_RESUME_CATCHUP", "12"))
+lease_keeper = LeaseKeeper(
+    storage.renew_leases,
+    storage.claim_leases,
+    NODE_ID,
+    on_claim=lambda task_ids: run_flow(storage, node.resume_agents(task_ids)),
+    on_lost=drop_agent,
+    running=lambda: scheduler.running() + admission.waiting(),
+    ttl=float(os.getenv("AGENT_LEASE_TTL", "30")),
+    capacity=NODE_CAPACITY,
+    claim_rate=float(os.getenv("AGENT_RESUME_RATE", "50")),
+)
+
+# Запуск, возобновление и остановка агентов, чтение статуса – общие с asgi_app.py (agent_node.py)
+node = AgentNode(
+    status_cache, status_broker, trade_writer, admission, lease_keeper, NODE_ID,
+    interval=scheduler.interval,
+    resume_catch_up=RESUME_MAX_CATCHUP,
+    start_agent=start_agent,
+    stop_agent=scheduler.stop,
+    is_running=scheduler.is_running,
+)
+
+def shutdown():
+    """
+    Остановка процесса: тики -> сброс буфера сделок -> аренды сразу доступны другим узлам
+    (и ждавшие в очереди запуски – их запустит узел, который заберёт аренду).
+    """
+    admission.close()
+    scheduler.shutdown()
+    lease_keeper.close()
+    trade_writer.close()
+    try:
+        storage.expire_leases(NODE_ID)
+    except StorageUnavailable:
+        pass
 
-def simulate_trading(task_id):
+_background_lock = threading.Lock()
+_background_started = False
+
+def start_background():
     """
-    Бесконечная симуляция (каждые 5 сек), пока статус != "зупинено".
+    Запуск фоновых потоков (запись сделок, планировщик, аренды) – один раз на процесс,
+    при первом запросе или из __main__, а не при импорте: родитель werkzeug-reloader
+    и мастер gunicorn --preload агентов не гоняют.
     """
-    import random
-    from datetime import datetime
-    symbols = ["$DOGE", "$XRP", "$HAI", "$SOM", "$BTC", "$ETH"]
-    sides = ["buy", "sell"]
-
-    while True:
-        # 1. Проверка статуса
-        conn = get_db_connection()
-        if not conn:
-            break
-        cursor = conn.cursor()
-        cursor.execute("SELECT status FROM tasks WHERE id=%s", (task_id,))
-        row = cursor.fetchone()
-        if not row or row["status"] == "зупинено":
-            cursor.close()
-            conn.close()
-            break
-
-        # 2. Генерируем случайную сделку
-        symbol = random.choice(symbols)
-        side = random.choice(sides)
-        amount = round(random.uniform(10, 100), 2)
-        change_pnl = round(random.uniform(-2.0, 3.0), 2)
-
-        # 3. Запишем в trade_logs
-        insert_log_query = """
-            INSERT INTO trade_logs (task_id, log_time, symbol, side, amount, pnl_change)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(insert_log_query, (task_id, datetime.now(), symbol, side, amount, change_pnl))
-
-        # 4. Обновим pnl и fee
-        update_tasks_query = """
-            UPDATE tasks
-            SET pnl = pnl + %s,
-                total_fee = total_fee + 0.05
-            WHERE id = %s
-        """
-        cursor.execute(update_tasks_query, (change_pnl, task_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
-
-        # 5. Ждём 5 секунд
-        time.sleep(5)
-
-    # Когда цикл заканчивается (30с прошли),
-    # Если задача не остановлена, меняем статус на “Результат: ...”
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT status FROM tasks WHERE id=%s", (task_id,))
-            row = cursor.fetchone()
-            if row and row["status"] != "зупинено":
-                finish_text = "Результат: агент завершил работу"
-                update_query = "UPDATE tasks SET status=%s WHERE id=%s"
-                cursor.execute(update_query, (finish_text, task_id))
-                conn.commit()
-            cursor.close()
-        finally:
-            conn.close()
+    global _background_started
+    if _background_started:
+        return
+    with _background_lock:
+        if _background_started:
+            return
+        trade_writer.start()
+        scheduler.start()
+        lease_keeper.start()
+        atexit.register(shutdown)
+        _background_started = True
+
+@app.before_request
+def ensure_background():
+    start_background()
+
+metrics.gauge("active_agents", "Агенты в расписании планировщика", scheduler.running)
+metrics.gauge("sse_subscribers", "Открытые SSE-потоки статуса", status_broker.subscriber_count)
+metrics.gauge("trade_buffer_pending", "Сделки, ожидающие записи в БД", trade_writer.pending)
+metrics.gauge("agent_start_queue", "Запуски агентов в очереди admission", lambda: admission.stats()["pending"])
+metrics.gauge("agent_leases", "Аренды агентов, которые держит узел", lease_keeper.held)
+metrics.gauge("status_cache_tasks", "Задачи в кэше статуса", lambda: status_cache.stats()["tasks"])
+metrics.gauge("db_pool_connections", "Соединения пула по состоянию",
+              lambda: {(("state", key),): storage.stats()["pool"][key] for key in ("in_use", "idle")})
 
 @app.route('/')
 def home():
@@ -204,8 +293,9 @@ def process_data():
     """
     Принимает JSON:
       { "number": <число>, "slider_value": <значение>, "period": <строка> }
-    Записывает в БД, запускает фоновую симуляцию,
+    Записывает в БД, запускает фоновую симуляцию (или ставит запуск в очередь),
     устанавливает флаг и возвращает URL для перехода на /status/<id>.
+    При перегрузке – 429 с Retry-After (см. admission.py).
     """
     data = request.get_json()
     if not data:
@@ -217,34 +307,24 @@ def process_data():
     if number is None or slider_value is None or period is None:
         return jsonify({"error": "Відсутні необхідні поля"}), 400
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Проблема з підключенням до БД"}), 500
+    # Лимиты процесса и сессии проверяются до БД: отказ при перегрузке ничего не стоит
+    client_id = session.setdefault('client_id', secrets.token_hex(8))
+    try:
+        reservation = admission.reserve(client_id)
+    except Overloaded as e:
+        return jsonify({"error": e.reason, "retry_after": e.retry_after}), 429, {"Retry-After": str(e.retry_after)}
 
-    agent_name = generate_agent_name()
-    start_time = datetime.now()
     try:
-        cursor = conn.cursor()
-        insert_query = """
-            INSERT INTO tasks (number, slider_value, period, status, agent_name, start_time)
-            VALUES (%s, %s, %s, %s, %s, %s)
-        """
-        cursor.execute(insert_query, (number, slider_value, period, "в обробці", agent_name, start_time))
-        task_id = cursor.lastrowid
-        conn.commit()
-        cursor.close()
-    finally:
-        conn.close()
+        task_id, position = run_flow(storage, node.create_agent(reservation, number, slider_value, period))
+    except StorageUnavailable:
+        return jsonify({"error": "Проблема з підключенням до БД"}), 500
 
     # Запоминаем в сессии
     session['agent_running'] = True
     session['agent_id'] = task_id
 
-    # Запускаем поток симуляции
-    thread = threading.Thread(target=simulate_trading, args=(task_id,))
-    thread.start()
-
-    return jsonify({"status_url": url_for('status_page', task_id=task_id, _external=True)})
+    return jsonify({"status_url": url_for('status_page', task_id=task_id, _external=True),
+                    "queued": bool(position)})
 
 @app.route('/status/<int:task_id>', methods=['GET'])
 def status_page(task_id):
@@ -252,133 +332,166 @@ def status_page(task_id):
     Страница управления. Из templates/status.html подгружается JS,
     который каждые N секунд будет дергать /status_data/<task_id> (JSON)
     для обновления логов, PnL, Uptime, графика и т.д.
+    Без SSE: открытый поток держал бы поток воркера Flask, пока открыт дашборд, –
+    опрос по since с ETag (304 без изменений) воркер не занимает. SSE – в asgi_app.py.
     """
-    return render_template("status.html", task_id=task_id)
+    return render_template("status.html", task_id=task_id, use_sse=False)
 
 @app.route('/stop/<int:task_id>', methods=['POST'])
 def stop_task(task_id):
     """
     Маркируем статус='зупинено', убираем данные из сессии.
-    Фоновый поток при следующем цикле проверки увидит “зупинено” и завершится.
+    Агент снимается с расписания сразу – следующего тика не будет.
+    Если агент работает на другом узле, тот узнает об остановке по снятой аренде.
     """
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            update_query = "UPDATE tasks SET status = %s WHERE id = %s"
-            cursor.execute(update_query, ("зупинено", task_id))
-            conn.commit()
-            cursor.close()
-        finally:
-            conn.close()
+    run_flow(storage, node.stop_task(task_id))
     session.pop('agent_running', None)
     session.pop('agent_id', None)
     return jsonify({"result": "зупинено"})
 
 @app.route('/status_data/<int:task_id>', methods=['GET'])
 def status_data(task_id):
-    conn = get_db_connection()
-    if not conn:
+    """
+    Данные для страницы статуса. Горячие задачи отдаются из status_cache без MySQL;
+    задачи, чей агент тикает на другом узле (или не тикает), – из БД.
+    Параметр ?since=<t_ms> (время последней уже полученной сделки) включает
+    инкрементальный режим: в logs и chart_data попадают только сделки новее since,
+    заголовок (PnL, fee, uptime, статус) – как обычно.
+    В ответе last_ts – курсор для следующего запроса.
+    Параметр ?max_points=<N> прореживает chart_data (LTTB) до N точек
+    (3..status_view.MAX_POINTS; без параметра – MAX_POINTS, меньше 3 – 400).
+    Ответ несёт слабый ETag: повторный опрос без изменений получает 304.
+    """
+    since = request.args.get("since", type=int)
+    try:
+        max_points = parse_max_points(request.args.get("max_points", type=int))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        result = run_flow(storage, node.status_data(task_id, since, max_points, request.if_none_match.contains_weak))
+    except StorageUnavailable:
+        return jsonify({"error": "DB connection failed"}), 500
+    if result is None:
+        return jsonify({"error": "Task not found"}), 404
+    tag, payload = result
+    if payload is None:
+        return not_modified(Response, tag)
+    return with_etag(jsonify(payload), tag)
+
+@app.route("/query_stats", methods=["GET"])
+def query_stats_endpoint():
+    """SQL по убыванию суммарного времени (?limit=N) и последние медленные запросы."""
+    return jsonify(query_stats.stats(limit=request.args.get("limit", 50, type=int)))
+
+@app.route('/pnl_candles/<int:task_id>', methods=['GET'])
+def pnl_candles(task_id):
+    """
+    Свечи кумулятивного PnL задачи из свёрток trade_rollups (без чтения сделок).
+    Параметры: from, to – миллисекунды (по умолчанию последние сутки),
+    resolution – 60 или 3600 (по умолчанию – по длине интервала).
+    """
+    end = request.args.get("to", type=int)
+    end = from_ms(end) if end is not None else datetime.now()
+    start = request.args.get("from", type=int)
+    start = from_ms(start) if start is not None else end - timedelta(days=1)
+    start, end, resolution = candle_range(start, end, request.args.get("resolution", type=int))
+    try:
+        rows = storage.rollup_candles(task_id, resolution, start, end)
+    except StorageUnavailable:
+        return jsonify({"error": "DB connection failed"}), 500
+    return jsonify(candles_payload(rows, resolution))
+
+@app.route('/export/trades', methods=['GET'])
+def export_trades():
+    """
+    Выгрузка сделок для офлайн-анализа: ?task_id=<id> и/или окно ?from=&to= (мс),
+    ?format=ndjson|csv. Ответ идёт потоком, память не зависит от объёма.
+    """
+    try:
+        fmt, task_id, start, end = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    chunks = storage.iter_trade_chunks(task_id, start, end)
+    return Response(stream_with_context(format_chunks(chunks, fmt)), mimetype=EXPORT_FORMATS[fmt],
+                    headers={"Content-Disposition": f"attachment; filename={export_filename(fmt, task_id)}"})
+
+@app.route("/write_buffer_stats", methods=["GET"])
+def write_buffer_stats():
+    """Очередь и пропускная способность write-behind записи сделок."""
+    return jsonify(trade_writer.stats())
+
+@app.route("/lease_stats", methods=["GET"])
+def lease_stats():
+    """Аренды агентов этого узла: сколько держит, забрал и потерял."""
+    return jsonify(lease_keeper.stats())
+
+@app.route("/admission_stats", methods=["GET"])
+def admission_stats():
+    """Лимиты запуска агентов, очередь и отказы (429)."""
+    return jsonify(admission.stats())
+
+@app.route("/queue/<int:task_id>", methods=["GET"])
+def queue_position(task_id):
+    """Место запуска в общей очереди всех узлов (по БД); position = null – задача не ждёт."""
+    try:
+        return jsonify(storage.queue_position(task_id))
+    except StorageUnavailable:
         return jsonify({"error": "DB connection failed"}), 500
 
+@app.route("/status_cache_stats", methods=["GET"])
+def status_cache_stats():
+    """Заполненность и попадания кэша статуса."""
+    return jsonify(status_cache.stats())
+
+def remote_version(task_id):
     try:
-        cursor = conn.cursor()
-        # Смотрим данные в tasks
-        cursor.execute("""
-            SELECT status, agent_name, start_time, pnl, total_fee,
-                   slider_value, period, number
-            FROM tasks
-            WHERE id = %s
-        """, (task_id,))
-        task_row = cursor.fetchone()
-        if not task_row:
-            cursor.close()
-            return jsonify({"error": "Task not found"}), 404
-
-        # Вычислим uptime
-        from datetime import datetime
-        start_time = task_row["start_time"]
-        if start_time is None:
-            uptime_str = "N/A"
-        else:
-            delta = datetime.now() - start_time
-            hours, remainder = divmod(int(delta.total_seconds()), 3600)
-            minutes, seconds = divmod(remainder, 60)
-            uptime_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-
-        # Преобразуем slider_value в текст риска
-        risk_map = {
-            1.0: "Low",
-            2.0: "Mid",
-            3.0: "High"
-        }
-        # slider_value мог быть Decimal или float; приводим к float для словаря
-        raw_slider = float(task_row["slider_value"]) if task_row["slider_value"] else 2.0
-        risk_text = risk_map.get(raw_slider, "Unknown")
-
-        # Логи (берём последние 20)
-        cursor.execute("""
-            SELECT log_time, symbol, side, amount, pnl_change
-            FROM trade_logs
-            WHERE task_id = %s
-            ORDER BY log_time DESC
-            LIMIT 20
-        """, (task_id,))
-        logs = cursor.fetchall()
-
-        # Логи -> список
-        log_list = []
-        for row in logs:
-            dt_str = row["log_time"].strftime("%Y-%m-%d %H:%M:%S")
-            log_list.append({
-                "log_time": dt_str,
-                "symbol": row["symbol"],
-                "side": row["side"],
-                "amount": float(row["amount"]),
-                "pnl_change": float(row["pnl_change"])
-            })
-
-        # Данные для графика (кумулятивный PnL)
-        cursor.execute("""
-            SELECT log_time, pnl_change
-            FROM trade_logs
-            WHERE task_id = %s
-            ORDER BY log_time ASC
-        """, (task_id,))
-        all_trades = cursor.fetchall()
-
-        chart_data = []
-        cumulative_pnl = 0.0
-        for tr in all_trades:
-            cumulative_pnl += float(tr["pnl_change"])
-            t_ms = int(tr["log_time"].timestamp() * 1000)
-            chart_data.append([t_ms, round(cumulative_pnl, 2)])
-
-        status_value = task_row["status"]
-        agent_name = task_row["agent_name"]
-        pnl_value = float(task_row["pnl"]) if task_row["pnl"] else 0.0
-        fee_value = float(task_row["total_fee"]) if task_row["total_fee"] else 0.0
-        period_val = task_row["period"] or "N/A"
-        operated_amount = float(task_row["number"]) if task_row["number"] else 0.0
-
-        cursor.close()
-        return jsonify({
-            "status": status_value,
-            "agent_name": agent_name,
-            "uptime": uptime_str,
-            "pnl": pnl_value,
-            "total_fee": fee_value,
-            "logs": log_list,
-            "chart_data": chart_data,
-            # Новые ключи для отображения на фронтенде
-            "risk_text": risk_text,
-            "period": period_val,
-            "operated_amount": operated_amount
-        })
-
-    finally:
-        conn.close()
+        return storage.task_version(task_id)
+    except StorageUnavailable:
+        return None
+
+@app.route('/status_stream/<int:task_id>', methods=['GET'])
+def status_stream(task_id):
+    """
+    SSE-поток дельт по задаче: событие trade на каждую сделку (новые строки лога,
+    точки графика, PnL, fee) и status при остановке. Начальное состояние и
+    догонялка после переподключения – через /status_data?since=...
+    Страница статуса Flask-приложения поток не открывает (см. status_page): каждый
+    подписчик держит поток воркера. Если агент тикает не в этом процессе, дельт нет: раз в SSE_REMOTE_POLL_SECONDS
+    сверяется версия задачи в БД, при изменении – событие reset (клиент догружает по since).
+    """
+    sub = status_broker.subscribe(task_id)
+
+    def generate():
+        try:
+            yield "retry: 5000\n\n"
+            version = None if lease_keeper.holds(task_id) else remote_version(task_id)
+            while True:
+                local = lease_keeper.holds(task_id)
+                event = sub.get(timeout=SSE_KEEPALIVE_SECONDS if local else SSE_REMOTE_POLL_SECONDS)
+                if event is not None:
+                    yield format_sse(event)
+                    continue
+                if lease_keeper.holds(task_id):
+                    version = None
+                    yield ": keepalive\n\n"
+                    continue
+                current = remote_version(task_id)
+                if current is not None and current != version:
+                    yield format_sse({"type": "reset"})
+                    version = current
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            status_broker.unsubscribe(sub)
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 if __name__ == '__main__':
+    # С debug=True werkzeug перезапускает скрипт в дочернем процессе (WERKZEUG_RUN_MAIN=true):
+    # агенты работают только там, родитель лишь следит за файлами
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background()
     # Запускаем на порту 8080, debug=True для отладки
     app.run(debug=True, port=8080)
@@ -0,0 +1,454 @@
+"""
+Асинхронный (ASGI) вариант two_screens на Quart + aiomysql.
+
+Маршруты и формы JSON – те же, что в app.py, но обработчики не занимают поток
+на время ожидания MySQL, а агенты симулятора – это задачи asyncio, а не потоки.
+Один процесс держит тысячи открытых дашбордов (опрос и SSE).
+
+Запуск:  hypercorn asgi_app:app   (или uvicorn asgi_app:app)
+"""
+import asyncio
+import os
+import secrets
+import socket
+from datetime import datetime, timedelta
+
+from quart import Quart, Response, g, request, jsonify, render_template, url_for, redirect, session
+
+from admission import AdmissionControl, Overloaded
+from agent_node import AgentNode, arun_flow
+from async_storage import create_async_storage
+from chart_data import ResponseCache, chart_payload, parse_chart_args
+from etags import make_etag, not_modified, with_etag
+from events import AsyncSubscription, EventBroker, format_sse
+from export import EXPORT_FORMATS, aformat_chunks, export_filename, parse_export_args
+from fast_json import OrjsonProvider, compress_quart_response
+from leases import LeaseKeeper
+from metrics import create_metrics
+from query_stats import QueryStats
+from rollups import candle_range
+from status_cache import StatusCache
+from status_view import candles_payload, from_ms, parse_max_points
+from storage import StorageUnavailable, query_listeners
+from write_buffer import BufferFull, TradeWriteBuffer
+
+app = Quart(__name__)
+app.secret_key = 'your_secret_key_here'  # В реальном проекте используйте переменные окружения
+app.json = OrjsonProvider(app)
+
+AGENT_TICK_SECONDS = float(os.getenv("AGENT_TICK_SECONDS", "5"))
+RESUME_MAX_CATCHUP = int(os.getenv("AGENT_RESUME_CATCHUP", "12"))
+DB_MIGRATE_ON_START = os.getenv("DB_MIGRATE_ON_START", "1") != "0"
+SSE_KEEPALIVE_SECONDS = 15
+SSE_REMOTE_POLL_SECONDS = 5
+
+storage = create_async_storage()
+status_broker = EventBroker(queue_size=int(os.getenv("SSE_QUEUE_SIZE", "100")),
+                            subscription_class=AsyncSubscription)
+status_cache = StatusCache(
+    max_tasks=int(os.getenv("STATUS_CACHE_TASKS", "1000")),
+    ttl=int(os.getenv("STATUS_CACHE_TTL", "300")),
+    max_points=int(os.getenv("STATUS_CACHE_MAX_POINTS", "50000")),
+)
+
+chart_cache = ResponseCache(ttl=float(os.getenv("CHART_CACHE_TTL", "10")))
+
+# Запущенные агенты: task_id -> (asyncio.Task, asyncio.Event остановки)
+agents = {}
+trade_writer = None
+lease_keeper = None
+node = None
+event_loop = None
+# Аренды агентов в БД – как в app.py
+NODE_ID = f"{os.getenv('NODE_ID', socket.gethostname())}:{os.getpid()}"
+NODE_CAPACITY = int(os.getenv("AGENT_NODE_CAPACITY", "1000"))
+# Допуск новых агентов – как в app.py
+admission = AdmissionControl(
+    lambda: len(agents),
+    max_agents=NODE_CAPACITY,
+    per_session=int(os.getenv("AGENT_SESSION_LIMIT", "5")),
+    max_pending=int(os.getenv("AGENT_START_QUEUE", "100")),
+    retry_after=int(os.getenv("AGENT_RETRY_AFTER", "5")),
+)
+
+# Метрики – как в app.py; SQL привязывается к запросу через contextvars задачи asyncio
+metrics = create_metrics()
+query_listeners.append(metrics.on_query)
+query_stats = QueryStats(slow_threshold=float(os.getenv("SLOW_QUERY_MS", "200")) / 1000)
+query_listeners.append(query_stats.on_query)
+metrics.gauge("active_agents", "Агенты в расписании планировщика", lambda: len(agents))
+metrics.gauge("sse_subscribers", "Открытые SSE-потоки статуса", status_broker.subscriber_count)
+metrics.gauge("trade_buffer_pending", "Сделки, ожидающие записи в БД", lambda: trade_writer.pending())
+metrics.gauge("agent_start_queue", "Запуски агентов в очереди admission", lambda: admission.stats()["pending"])
+metrics.gauge("agent_leases", "Аренды агентов, которые держит узел", lambda: lease_keeper.held())
+metrics.gauge("status_cache_tasks", "Задачи в кэше статуса", lambda: status_cache.stats()["tasks"])
+metrics.gauge("db_pool_connections", "Соединения пула по состоянию",
+              lambda: {(("state", key),): storage.stats()["pool"][key] for key in ("in_use", "idle")})
+
+
+def run_from_thread(coro):
+    """Фоновые потоки (буфер записи, аренды) выполняют запрос в event loop и ждут результат."""
+    return asyncio.run_coroutine_threadsafe(coro, event_loop).result(timeout=60)
+
+
+def write_trades_from_thread(rows, totals):
+    return run_from_thread(storage.write_trades(rows, totals))
+
+
+@app.before_serving
+async def startup():
+    global trade_writer, lease_keeper, node, event_loop
+    event_loop = asyncio.get_running_loop()
+    await storage.open(migrate=DB_MIGRATE_ON_START)
+    # put_timeout=0: event loop нельзя блокировать ожиданием места в буфере,
+    # при переполнении тик пропускается
+    trade_writer = TradeWriteBuffer(
+        write_trades_from_thread,
+        flush_interval=float(os.getenv("TRADE_FLUSH_SECONDS", "1")),
+        batch_size=int(os.getenv("TRADE_FLUSH_BATCH", "1000")),
+        max_pending=int(os.getenv("TRADE_MAX_PENDING", "20000")),
+        put_timeout=0,
+        on_flush=status_cache.invalidate_loads,
+    )
+    trade_writer.start()
+    lease_keeper = LeaseKeeper(
+        lambda node_id, ttl: run_from_thread(storage.renew_leases(node_id, ttl)),
+        lambda node_id, ttl, limit: run_from_thread(storage.claim_leases(node_id, ttl, limit)),
+        NODE_ID,
+        on_claim=lambda task_ids: run_from_thread(arun_flow(storage, node.resume_agents(task_ids))),
+        on_lost=lambda task_id: asyncio.run_coroutine_threadsafe(arun_flow(storage, node.drop_agent(task_id)),
+                                                                 event_loop),
+        running=lambda: len(agents) + admission.waiting(),
+        ttl=float(os.getenv("AGENT_LEASE_TTL", "30")),
+        capacity=NODE_CAPACITY,
+        claim_rate=float(os.getenv("AGENT_RESUME_RATE", "50")),
+    )
+    # Запуск, возобновление и остановка агентов, чтение статуса – общие с app.py (agent_node.py)
+    node = AgentNode(
+        status_cache, status_broker, trade_writer, admission, lease_keeper, NODE_ID,
+        interval=AGENT_TICK_SECONDS,
+        resume_catch_up=RESUME_MAX_CATCHUP,
+        start_agent=start_agent,
+        stop_agent=stop_agent,
+        is_running=lambda task_id: task_id in agents,
+    )
+    lease_keeper.start()
+
+
+@app.after_serving
+async def shutdown():
+    # Ждавшие в очереди запуски держат аренды – после expire_leases их запустят другие узлы
+    admission.close()
+    for task, stop_event in list(agents.values()):
+        stop_event.set()
+    await asyncio.gather(*(task for task, _ in agents.values()), return_exceptions=True)
+    # Поток аренд ждёт event loop – останавливаем его, не блокируя loop
+    await asyncio.to_thread(lease_keeper.close)
+    await asyncio.to_thread(trade_writer.close)
+    try:
+        await storage.expire_leases(NODE_ID)
+    except StorageUnavailable:
+        pass
+    await storage.close()
+
+
+@app.before_request
+async def start_request_metrics():
+    g.metrics_started = metrics.begin_request()
+
+
+@app.after_request
+async def finish_request_metrics(response):
+    started = g.pop("metrics_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        metrics.end_request(started, route, request.method, response.status_code)
+    return response
+
+
+@app.after_request
+async def compress(response):
+    return await compress_quart_response(response, request.accept_encodings)
+
+
+@app.route("/metrics", methods=["GET"])
+async def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+async def simulate_trading(task_id, stop_event, state=None, delay=0.0):
+    """
+    Агент как задача asyncio: тик каждые AGENT_TICK_SECONDS, остановка – через stop_event.
+    state – уже загруженное состояние (resume_agents), delay – задержка первого тика.
+    """
+    try:
+        if state is None:
+            state = await arun_flow(storage, node.load_agent(task_id))
+            if state is None:
+                return
+        if delay:
+            try:
+                await asyncio.wait_for(stop_event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        while not stop_event.is_set():
+            # Без подтверждённой аренды тик пропускаем (см. leases.py)
+            if lease_keeper.holds(task_id):
+                try:
+                    node.record_trade(task_id, state)
+                except BufferFull as e:
+                    # put_timeout=0: event loop не ждёт места в буфере, тик пропускается
+                    print(f"Пропущен тик агента {task_id}: {e}")
+            try:
+                await asyncio.wait_for(stop_event.wait(), AGENT_TICK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        current = agents.get(task_id)
+        if current is not None and current[1] is stop_event:
+            del agents[task_id]
+            await arun_flow(storage, node.agent_removed(task_id))
+
+
+def start_agent(task_id, state=None, delay=None):
+    if task_id in agents:
+        return
+    stop_event = asyncio.Event()
+    agents[task_id] = (asyncio.create_task(simulate_trading(task_id, stop_event, state, delay)), stop_event)
+
+
+def stop_agent(task_id):
+    """Останавливает агента на этом узле, статус задачи не меняется; False – агента здесь нет."""
+    agent = agents.get(task_id)
+    if agent is None:
+        return False
+    agent[1].set()
+    return True
+
+
+@app.route("/pool_stats", methods=["GET"])
+async def pool_stats():
+    """Статистика соединений хранилища (in_use, idle) для подбора размеров пула."""
+    return jsonify(storage.stats())
+
+
+@app.route("/chart_data", methods=["GET"])
+async def chart_data():
+    """PnL задач для графика на странице input (параметры – как в app.py)."""
+    try:
+        query = parse_chart_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    cached = chart_cache.get(query)
+    if cached is None:
+        try:
+            payload = chart_payload(query, await storage.chart_data(query))
+        except StorageUnavailable:
+            return jsonify({"error": "DB connection failed"}), 500
+        cached = (payload, make_etag(query, payload))
+        chart_cache.put(query, cached)
+    payload, tag = cached
+    if request.if_none_match.contains_weak(tag):
+        return not_modified(Response, tag)
+    return with_etag(jsonify(payload), tag)
+
+
+@app.route('/')
+async def home():
+    """Если агент запущен, перенаправляем на страницу status, иначе – на страницу input."""
+    if session.get('agent_running'):
+        agent_id = session.get('agent_id')
+        if agent_id:
+            return redirect(url_for('status_page', task_id=agent_id))
+    return redirect(url_for('input_page'))
+
+
+@app.route('/input', methods=['GET'])
+async def input_page():
+    if session.get('agent_running'):
+        agent_id = session.get('agent_id')
+        if agent_id:
+            return redirect(url_for('status_page', task_id=agent_id))
+    return await render_template("input.html")
+
+
+@app.route('/process', methods=['POST'])
+async def process_data():
+    """
+    Принимает JSON:
+      { "number": <число>, "slider_value": <значение>, "period": <строка> }
+    Записывает в БД, запускает агента (задача asyncio) или ставит запуск в очередь
+    и возвращает URL для перехода на /status/<id>; при перегрузке – 429 (см. admission.py).
+    """
+    data = await request.get_json()
+    if not data:
+        return jsonify({"error": "Немає даних"}), 400
+
+    number = data.get("number")
+    slider_value = data.get("slider_value")
+    period = data.get("period")
+    if number is None or slider_value is None or period is None:
+        return jsonify({"error": "Відсутні необхідні поля"}), 400
+
+    client_id = session.setdefault('client_id', secrets.token_hex(8))
+    try:
+        reservation = admission.reserve(client_id)
+    except Overloaded as e:
+        return jsonify({"error": e.reason, "retry_after": e.retry_after}), 429, {"Retry-After": str(e.retry_after)}
+
+    try:
+        task_id, position = await arun_flow(storage, node.create_agent(reservation, number, slider_value, period))
+    except StorageUnavailable:
+        return jsonify({"error": "Проблема з підключенням до БД"}), 500
+
+    # Запоминаем в сессии
+    session['agent_running'] = True
+    session['agent_id'] = task_id
+
+    return jsonify({"status_url": url_for('status_page', task_id=task_id, _external=True),
+                    "queued": bool(position)})
+
+
+@app.route('/status/<int:task_id>', methods=['GET'])
+async def status_page(task_id):
+    # Поток SSE – корутина, а не поток воркера: дашборд подписывается на дельты
+    return await render_template("status.html", task_id=task_id, use_sse=True)
+
+
+@app.route('/stop/<int:task_id>', methods=['POST'])
+async def stop_task(task_id):
+    """Маркируем статус='зупинено', снимаем аренду, останавливаем агента, убираем данные из сессии."""
+    await arun_flow(storage, node.stop_task(task_id))
+    session.pop('agent_running', None)
+    session.pop('agent_id', None)
+    return jsonify({"result": "зупинено"})
+
+
+@app.route('/status_data/<int:task_id>', methods=['GET'])
+async def status_data(task_id):
+    """Данные для страницы статуса; параметры since и max_points – как в app.py."""
+    since = request.args.get("since", type=int)
+    try:
+        max_points = parse_max_points(request.args.get("max_points", type=int))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        result = await arun_flow(storage, node.status_data(task_id, since, max_points,
+                                                           request.if_none_match.contains_weak))
+    except StorageUnavailable:
+        return jsonify({"error": "DB connection failed"}), 500
+    if result is None:
+        return jsonify({"error": "Task not found"}), 404
+    tag, payload = result
+    if payload is None:
+        return not_modified(Response, tag)
+    return with_etag(jsonify(payload), tag)
+
+
+@app.route('/pnl_candles/<int:task_id>', methods=['GET'])
+async def pnl_candles(task_id):
+    """Свечи кумулятивного PnL из trade_rollups; параметры – как в app.py."""
+    end = request.args.get("to", type=int)
+    end = from_ms(end) if end is not None else datetime.now()
+    start = request.args.get("from", type=int)
+    start = from_ms(start) if start is not None else end - timedelta(days=1)
+    start, end, resolution = candle_range(start, end, request.args.get("resolution", type=int))
+    try:
+        rows = await storage.rollup_candles(task_id, resolution, start, end)
+    except StorageUnavailable:
+        return jsonify({"error": "DB connection failed"}), 500
+    return jsonify(candles_payload(rows, resolution))
+
+
+@app.route('/export/trades', methods=['GET'])
+async def export_trades():
+    """Потоковая выгрузка сделок (параметры – как в app.py)."""
+    try:
+        fmt, task_id, start, end = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    chunks = storage.iter_trade_chunks(task_id, start, end)
+    response = Response(aformat_chunks(chunks, fmt), mimetype=EXPORT_FORMATS[fmt],
+                        headers={"Content-Disposition": f"attachment; filename={export_filename(fmt, task_id)}"})
+    response.timeout = None  # большая выгрузка может идти дольше стандартного таймаута
+    return response
+
+
+@app.route("/query_stats", methods=["GET"])
+async def query_stats_endpoint():
+    return jsonify(query_stats.stats(limit=request.args.get("limit", 50, type=int)))
+
+
+@app.route("/write_buffer_stats", methods=["GET"])
+async def write_buffer_stats():
+    return jsonify(trade_writer.stats())
+
+
+@app.route("/lease_stats", methods=["GET"])
+async def lease_stats():
+    return jsonify(lease_keeper.stats())
+
+
+@app.route("/admission_stats", methods=["GET"])
+async def admission_stats():
+    return jsonify(admission.stats())
+
+
+@app.route("/queue/<int:task_id>", methods=["GET"])
+async def queue_position(task_id):
+    """Место запуска в общей очереди всех узлов (по БД, см. app.py)."""
+    try:
+        return jsonify(await storage.queue_position(task_id))
+    except StorageUnavailable:
+        return jsonify({"error": "DB connection failed"}), 500
+
+
+@app.route("/status_cache_stats", methods=["GET"])
+async def status_cache_stats():
+    return jsonify(status_cache.stats())
+
+
+async def remote_version(task_id):
+    try:
+        return await storage.task_version(task_id)
+    except StorageUnavailable:
+        return None
+
+
+@app.route('/status_stream/<int:task_id>', methods=['GET'])
+async def status_stream(task_id):
+    """SSE-поток дельт по задаче (см. app.status_stream)."""
+    sub = status_broker.subscribe(task_id)
+
+    async def generate():
+        try:
+            yield "retry: 5000\n\n"
+            version = None if lease_keeper.holds(task_id) else await remote_version(task_id)
+            while True:
+                local = lease_keeper.holds(task_id)
+                event = await sub.get(SSE_KEEPALIVE_SECONDS if local else SSE_REMOTE_POLL_SECONDS)
+                if event is not None:
+                    yield format_sse(event)
+                    continue
+                if lease_keeper.holds(task_id):
+                    version = None
+                    yield ": keepalive\n\n"
+                    continue
+                current = await remote_version(task_id)
+                if current is not None and current != version:
+                    yield format_sse({"type": "reset"})
+                    version = current
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            status_broker.unsubscribe(sub)
+
+    response = Response(generate(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None  # поток живёт, пока открыт дашборд
+    return response
+
+
+if __name__ == '__main__':
+    app.run(debug=True, port=8080)
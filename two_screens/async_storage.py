@@ -0,0 +1,241 @@
+"""
+Асинхронное хранилище для asgi_app.py.
+
+AsyncMySQLStorage  – те же операции storage.Operations, что и у storage.SQLStorage, поверх пула aiomysql;
+ThreadedAsyncStorage – асинхронный фасад над синхронным хранилищем (SQLite для
+локальных прогонов): вызовы уходят в пул потоков через asyncio.to_thread.
+"""
+import asyncio
+import functools
+import os
+import time
+from contextlib import asynccontextmanager
+
+import aiomysql
+
+from chart_data import where_sql
+from export import EXPORT_CHUNK_ROWS, TRADES_EXPORT_QUERY, export_conditions
+from storage import (
+    COMMIT, DATABASE_CONFIG, MySQLStorage, Operations, StorageUnavailable, create_storage, notify_query,
+)
+
+
+def operation(op):
+    """Асинхронный метод хранилища из генератора storage.Operations (см. storage.operation)."""
+    @functools.wraps(op)
+    async def method(self, *args, **kwargs):
+        return await self.run(op(self, *args, **kwargs))
+    return method
+
+
+class _AsyncTimedCursor:
+    """Курсор aiomysql, сообщающий storage.query_listeners о каждом запросе."""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    async def execute(self, query, params=None):
+        started = time.perf_counter()
+        result = await self._raw.execute(query, params)
+        notify_query(query, params, time.perf_counter() - started, self._raw.rowcount)
+        return result
+
+    async def executemany(self, query, seq_of_params):
+        started = time.perf_counter()
+        result = await self._raw.executemany(query, seq_of_params)
+        notify_query(query, seq_of_params, time.perf_counter() - started, self._raw.rowcount)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class AsyncMySQLStorage:
+    dialect = "mysql"
+
+    def __init__(self, config, minsize=2, maxsize=50, pool_recycle=3600):
+        self._config = config
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.pool_recycle = pool_recycle
+        self.pool = None
+
+    async def open(self, migrate=True):
+        # Миграции (или проверка версии схемы) – один раз синхронно, отдельным коротким соединением
+        schema_storage = MySQLStorage(self._config, min_size=0, max_size=1)
+        try:
+            problems = await asyncio.to_thread(schema_storage.init_schema, migrate)
+        finally:
+            schema_storage.close()
+        for problem in problems:
+            print("Предупреждение (план запроса):", problem)
+        self.pool = await aiomysql.create_pool(
+            host=self._config["host"],
+            user=self._config["user"],
+            password=self._config["password"],
+            db=self._config["database"],
+            charset=self._config["charset"],
+            cursorclass=aiomysql.DictCursor,
+            minsize=self.minsize,
+            maxsize=self.maxsize,
+            pool_recycle=self.pool_recycle,
+            autocommit=False,
+        )
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+
+    def stats(self):
+        if self.pool is None:
+            return {}
+        return {"pool": {
+            "size": self.pool.size,
+            "in_use": self.pool.size - self.pool.freesize,
+            "idle": self.pool.freesize,
+            "min_size": self.minsize,
+            "max_size": self.maxsize,
+        }}
+
+    @asynccontextmanager
+    async def _cursor(self):
+        try:
+            conn = await self.pool.acquire()
+        except Exception as e:
+            print(f"Ошибка подключения к MySQL: {e}")
+            raise StorageUnavailable(str(e)) from e
+        try:
+            async with conn.cursor() as cursor:
+                yield conn, _AsyncTimedCursor(cursor)
+        finally:
+            # aiomysql закрывает соединения, возвращённые с открытой транзакцией
+            if conn.get_transaction_status():
+                await conn.rollback()
+            self.pool.release(conn)
+
+    async def run(self, operation):
+        """Выполняет операцию (генератор storage.Operations) на одном соединении, см. SQLStorage.run()."""
+        async with self._cursor() as (conn, cursor):
+            cursors = {False: cursor}
+            try:
+                result = None
+                while True:
+                    try:
+                        step = operation.send(result)
+                    except StopIteration as stop:
+                        return stop.value
+                    if step is COMMIT:
+                        await conn.commit()
+                        result = None
+                        continue
+                    cursor = cursors.get(step.tuples)
+                    if cursor is None:
+                        cursor = cursors[True] = _AsyncTimedCursor(await conn.cursor(aiomysql.Cursor))
+                    if step.many:
+                        await cursor.executemany(step.sql, step.params)
+                    else:
+                        await cursor.execute(step.sql, step.params)
+                    if step.fetch == "one":
+                        result = await cursor.fetchone()
+                    elif step.fetch == "all":
+                        result = await cursor.fetchall()
+                    else:
+                        result = getattr(cursor, step.fetch) if step.fetch else None
+            finally:
+                if True in cursors:
+                    await cursors[True].close()
+
+    create_task = operation(Operations.create_task)
+    get_agent = operation(Operations.get_agent)
+    get_agents = operation(Operations.get_agents)
+    set_status = operation(Operations.set_status)
+    finish_task = operation(Operations.finish_task)
+    start_queued = operation(Operations.start_queued)
+    queue_position = operation(Operations.queue_position)
+    chart_data = operation(Operations.chart_data)
+    task_version = operation(Operations.task_version)
+    load_status = operation(Operations.load_status)
+    write_trades = operation(Operations.write_trades)
+    rollup_candles = operation(Operations.rollup_candles)
+    claim_leases = operation(Operations.claim_leases)
+    renew_leases = operation(Operations.renew_leases)
+    release_lease = operation(Operations.release_lease)
+    expire_leases = operation(Operations.expire_leases)
+
+    async def iter_trade_chunks(self, task_id=None, start=None, end=None, chunk_size=EXPORT_CHUNK_ROWS):
+        """Асинхронный генератор пачек сделок через серверный курсор aiomysql.SSCursor."""
+        conditions, params = export_conditions(task_id, start, end)
+        try:
+            conn = await self.pool.acquire()
+        except Exception as e:
+            print(f"Ошибка подключения к MySQL: {e}")
+            raise StorageUnavailable(str(e)) from e
+        finished = False
+        try:
+            cursor = _AsyncTimedCursor(await conn.cursor(aiomysql.SSCursor))
+            await cursor.execute(TRADES_EXPORT_QUERY.format(where=where_sql(conditions), limit=""), params)
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+            await cursor.close()
+            if conn.get_transaction_status():
+                await conn.rollback()
+            finished = True
+        finally:
+            if not finished:
+                # Выгрузка прервана: закрываем соединение, не дочитывая результат
+                conn.close()
+            self.pool.release(conn)
+
+
+class ThreadedAsyncStorage:
+    """Любое синхронное хранилище из storage.py за асинхронным интерфейсом."""
+
+    def __init__(self, storage):
+        self._storage = storage
+        self.dialect = storage.dialect
+
+    async def open(self, migrate=True):
+        for problem in await asyncio.to_thread(self._storage.init_schema, migrate):
+            print("Предупреждение (план запроса):", problem)
+
+    async def close(self):
+        await asyncio.to_thread(self._storage.close)
+
+    def stats(self):
+        return self._storage.stats()
+
+    async def iter_trade_chunks(self, *args, **kwargs):
+        """Синхронный генератор пачек, каждая пачка читается в пуле потоков."""
+        chunks = self._storage.iter_trade_chunks(*args, **kwargs)
+        try:
+            while True:
+                rows = await asyncio.to_thread(next, chunks, None)
+                if rows is None:
+                    return
+                yield rows
+        finally:
+            chunks.close()
+
+    def __getattr__(self, name):
+        method = getattr(self._storage, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+        return call
+
+
+def create_async_storage():
+    """STORAGE_BACKEND=sqlite – SQLite через пул потоков, иначе aiomysql к DATABASE_CONFIG."""
+    if os.getenv("STORAGE_BACKEND", "mysql") == "sqlite":
+        return ThreadedAsyncStorage(create_storage())
+    return AsyncMySQLStorage(
+        DATABASE_CONFIG,
+        minsize=int(os.getenv("DB_POOL_MIN", "2")),
+        maxsize=int(os.getenv("DB_POOL_MAX", "50")),
+        pool_recycle=int(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+    )
@@ -0,0 +1,135 @@
+"""
+Офлайн-бектест: сделки множества агентов за длинный период генерируются сразу,
+векторно (numpy, если установлен), и массово загружаются в trade_logs.
+Нужен, чтобы за минуты наполнить базу реалистичным объёмом для нагрузочных прогонов
+(benchmark.py, /chart_data, /export/trades), а не ждать днями живых агентов.
+
+Сделки генерирует тот же simulator.SimulatorEngine, что и у живых агентов (стратегия –
+по slider_value задачи), блоками numpy, если он установлен. Seed агента – из --seed и
+номера агента, он же пишется в tasks.seed, поэтому повторный прогон с тем же --seed даёт
+те же сделки (с numpy и без него ряды разные, но каждый воспроизводим).
+Хранилище – как у приложения: STORAGE_BACKEND, SQLITE_PATH, DATABASE_CONFIG.
+
+Пример:
+  STORAGE_BACKEND=sqlite SQLITE_PATH=big.db python backtest.py --agents 200 --days 30
+  python backtest.py --agents 1000 --trades 20000 --seed 7
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from simulator import TRADE_FEE, SimulatorEngine, generate_agent_name, np, strategy_for
+from storage import create_storage
+
+# Задачи бектеста уже завершены: узлы не возобновляют их как запущенных агентов
+BACKTEST_STATUS = "Результат: бектест"
+ROLLUP_TASKS_PER_STATEMENT = 500
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Массовая генерация сделок агентов в trade_logs")
+    parser.add_argument("--agents", type=int, default=100, help="сколько задач (агентов) создать")
+    parser.add_argument("--days", type=float, default=7, help="длина истории каждого агента, дней")
+    parser.add_argument("--trades", type=int, help="сделок на агента (вместо --days)")
+    parser.add_argument("--tick", type=float, default=5, help="интервал между сделками агента, сек")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="конец истории (ISO), по умолчанию сейчас")
+    parser.add_argument("--seed", type=int, default=1, help="seed генераторов агентов")
+    parser.add_argument("--batch-rows", type=int, default=20000, help="сделок на транзакцию записи")
+    parser.add_argument("--json", dest="json_path", help="сохранить отчёт в JSON")
+    return parser.parse_args(argv)
+
+
+def agent_seed(seed, index):
+    """Независимый воспроизводимый seed агента index (tasks.seed)."""
+    return seed * 1_000_003 + index
+
+
+def trade_batch(engine, start, tick, first, count):
+    """
+    Сделки first .. first+count-1 агента (i-я – в start + i*tick):
+    [(log_time, symbol, side, amount, pnl_change), ...].
+    """
+    return engine.step([start + timedelta(seconds=int(i * tick)) for i in range(first, first + count)])
+
+
+def run(args):
+    storage = create_storage()
+    for problem in storage.init_schema():
+        print("Предупреждение (план запроса):", problem)
+
+    per_agent = args.trades if args.trades is not None else int(args.days * 86400 // args.tick)
+    end = (args.end or datetime.now()).replace(microsecond=0)
+    start = end - timedelta(seconds=int(per_agent * args.tick))
+    period = f"{round(per_agent * args.tick / 86400, 2)}d"
+    random.seed(args.seed)  # имена агентов
+
+    started = time.perf_counter()
+    generate_seconds = 0.0
+    task_ids = []
+    rows, totals = [], {}
+    for index in range(args.agents):
+        slider_value = index % 3 + 1
+        seed = agent_seed(args.seed, index)
+        task_id = storage.create_task(100 + index, slider_value, period, BACKTEST_STATUS,
+                                      generate_agent_name(), start, seed)
+        task_ids.append(task_id)
+        engine = SimulatorEngine(seed, strategy_for(slider_value), vectorized=True)
+        for first in range(0, per_agent, args.batch_rows):
+            count = min(args.batch_rows, per_agent - first)
+            generated = time.perf_counter()
+            trades = trade_batch(engine, start, args.tick, first, count)
+            rows.extend((task_id,) + trade for trade in trades)
+            pnl_sum, fee_sum = totals.get(task_id, (0.0, 0.0))
+            totals[task_id] = (pnl_sum + sum(trade[4] for trade in trades), fee_sum + count * TRADE_FEE)
+            generate_seconds += time.perf_counter() - generated
+            # Пачки нескольких агентов – в одну транзакцию, пока не набралось batch_rows
+            if len(rows) >= args.batch_rows:
+                storage.load_trades(rows, totals)
+                rows, totals = [], {}
+        if (index + 1) % 100 == 0:
+            print(f"  агентов: {index + 1}/{args.agents}, {time.perf_counter() - started:.1f} с")
+    if rows:
+        storage.load_trades(rows, totals)
+    load_seconds = time.perf_counter() - started
+
+    rollups_started = time.perf_counter()
+    for i in range(0, len(task_ids), ROLLUP_TASKS_PER_STATEMENT):
+        storage.rebuild_rollups(task_ids[i:i + ROLLUP_TASKS_PER_STATEMENT])
+    rollup_seconds = time.perf_counter() - rollups_started
+    storage.close()
+
+    total = per_agent * args.agents
+    return {
+        "config": {key: str(value) if isinstance(value, datetime) else value for key, value in vars(args).items()},
+        "vectorized": np is not None,
+        "tasks": [task_ids[0], task_ids[-1]] if task_ids else [],
+        "period": [start.isoformat(" "), end.isoformat(" ")],
+        "trades": total,
+        "generate_seconds": round(generate_seconds, 2),
+        "load_seconds": round(load_seconds, 2),
+        "rollup_seconds": round(rollup_seconds, 2),
+        "trades_per_second": round(total / load_seconds, 1) if load_seconds else 0.0,
+    }
+
+
+def print_report(report):
+    print(f"Задачи {report['tasks']}: {report['trades']} сделок за {report['period'][0]} – {report['period'][1]}")
+    print(f"Генерация {report['generate_seconds']} с ({'numpy' if report['vectorized'] else 'random'}), "
+          f"загрузка {report['load_seconds']} с ({report['trades_per_second']} сделок/с), "
+          f"свёртки {report['rollup_seconds']} с")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,240 @@
+"""
+Нагрузочный прогон two_screens без сети: приложение в том же процессе (Flask test client),
+хранилище – SQLite (в памяти по умолчанию).
+
+  1. запускает N агентов через /process (при желании – с историей сделок в trade_logs);
+  2. M потоков-опросчиков гоняют /status_data/<id> (полный снимок, затем ?since=...)
+     и /chart_data, как открытые дашборды;
+  3. печатает пропускную способность, перцентили задержек, SQL на запрос
+     и память/очередь записи во времени.
+
+Пример:
+  python benchmark.py --agents 50 --pollers 20 --duration 30 --history 5000 --json out.json
+  python benchmark.py --max-p95-ms 50      # код возврата 1, если p95 любого маршрута хуже
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон дашборда статуса и симулятора агентов")
+    parser.add_argument("--agents", type=int, default=20, help="сколько агентов запустить через /process")
+    parser.add_argument("--pollers", type=int, default=10, help="параллельных опросчиков")
+    parser.add_argument("--duration", type=float, default=20, help="длительность опроса, сек")
+    parser.add_argument("--tick", type=float, default=0.5, help="AGENT_TICK_SECONDS агентов")
+    parser.add_argument("--history", type=int, default=0, help="сделок истории на агента до старта")
+    parser.add_argument("--chart-share", type=float, default=0.1, help="доля запросов /chart_data")
+    parser.add_argument("--max-points", type=int, default=600, help="max_points в /status_data")
+    parser.add_argument("--poll-interval", type=float, default=0.0, help="пауза опросчика между запросами, сек")
+    parser.add_argument("--sample", type=float, default=1.0, help="период снятия памяти, сек")
+    parser.add_argument("--sqlite-path", default=":memory:", help="файл SQLite (по умолчанию в памяти)")
+    parser.add_argument("--seed", type=int, default=1, help="seed выбора задач опросчиками")
+    parser.add_argument("--json", dest="json_path", help="сохранить отчёт в JSON")
+    parser.add_argument("--max-p95-ms", type=float, help="порог p95 для кода возврата")
+    return parser.parse_args(argv)
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def rss_mb():
+    """Текущий RSS процесса (Linux /proc), иначе пиковый по getrusage."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}  # маршрут -> [сек]
+        self.errors = {}
+
+    def add(self, route, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+def seed_history(app_module, task_ids, per_task):
+    """История сделок прямо в хранилище – чтобы холодные чтения шли по «взрослым» задачам."""
+    start = datetime.now().replace(microsecond=0) - timedelta(seconds=per_task + 1)
+    rows, totals = [], {}
+    for task_id in task_ids:
+        for i in range(per_task):
+            change = round(random.uniform(-1, 1), 2)
+            rows.append((task_id, start + timedelta(seconds=i), "BTCUSDT", "BUY", 1.0, change))
+            pnl, fee = totals.get(task_id, (0.0, 0.0))
+            totals[task_id] = (pnl + change, fee)
+            if len(rows) >= 5000:
+                app_module.storage.write_trades(rows, totals)
+                rows, totals = [], {}
+    if rows:
+        app_module.storage.write_trades(rows, totals)
+
+
+def poller(app_module, task_ids, args, recorder, stop, rnd):
+    client = app_module.app.test_client()
+    cursors = {}
+    while not stop.is_set():
+        if rnd.random() < args.chart_share:
+            route, url = "/chart_data", "/chart_data"
+        else:
+            task_id = rnd.choice(task_ids)
+            since = cursors.get(task_id)
+            route = "/status_data" if since is None else "/status_data?since"
+            url = f"/status_data/{task_id}?max_points={args.max_points}"
+            if since is not None:
+                url += f"&since={since}"
+        started = time.perf_counter()
+        response = client.get(url)
+        recorder.add(route, time.perf_counter() - started, response.status_code == 200)
+        if route != "/chart_data" and response.status_code == 200:
+            last_ts = response.get_json().get("last_ts")
+            if last_ts is not None:
+                cursors[task_id] = last_ts
+        if args.poll_interval:
+            stop.wait(args.poll_interval)
+
+
+def sampler(app_module, started, args, samples, stop):
+    while True:
+        samples.append({
+            "t": round(time.perf_counter() - started, 1),
+            "rss_mb": round(rss_mb(), 1),
+            "agents": app_module.scheduler.running(),
+            "write_pending": app_module.trade_writer.pending(),
+            "cache_points": app_module.status_cache.stats()["points"],
+        })
+        if stop.wait(args.sample):
+            return
+
+
+def run(args):
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = args.sqlite_path
+    os.environ["AGENT_TICK_SECONDS"] = str(args.tick)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+
+    random.seed(args.seed)
+    task_ids = []
+    setup_started = time.perf_counter()
+    for i in range(args.agents):
+        client = app_module.app.test_client()
+        response = client.post("/process", json={"number": 100 + i, "slider_value": i % 5 + 1, "period": "1d"})
+        if response.status_code != 200:
+            raise SystemExit(f"/process вернул {response.status_code}: {response.get_data(as_text=True)}")
+        task_ids.append(int(response.get_json()["status_url"].rstrip("/").rsplit("/", 1)[-1]))
+    if args.history:
+        seed_history(app_module, task_ids, args.history)
+    setup_seconds = time.perf_counter() - setup_started
+
+    # Метрики маршрутов считаем только за время опроса
+    sql_before = app_module.metrics.series("http_request_sql_queries")
+    recorder = Recorder()
+    samples = []
+    stop = threading.Event()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=sampler, args=(app_module, started, args, samples, stop), daemon=True)]
+    for i in range(args.pollers):
+        rnd = random.Random(args.seed + i)
+        threads.append(threading.Thread(target=poller, args=(app_module, task_ids, args, recorder, stop, rnd),
+                                        daemon=True))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    sql_after = app_module.metrics.series("http_request_sql_queries")
+
+    sql_per_route = {}
+    for labels, (count, total) in sql_after.items():
+        prev_count, prev_total = sql_before.get(labels, (0, 0.0))
+        if count > prev_count:
+            sql_per_route[dict(labels)["route"]] = (total - prev_total) / (count - prev_count)
+
+    routes = {}
+    for route, values in sorted(recorder.latencies.items()):
+        values.sort()
+        template = "/chart_data" if route == "/chart_data" else "/status_data/<int:task_id>"
+        routes[route] = {
+            "requests": len(values),
+            "rps": round(len(values) / elapsed, 1),
+            "errors": recorder.errors.get(route, 0),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+            # для status_data полные и инкрементальные запросы в метриках – одна серия
+            "sql_per_request": round(sql_per_route.get(template, 0.0), 2),
+        }
+
+    app_module.scheduler.shutdown()
+    app_module.trade_writer.close()
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "config": vars(args),
+        "setup_seconds": round(setup_seconds, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "requests": total,
+        "rps": round(total / elapsed, 1),
+        "routes": routes,
+        "memory": samples,
+        "write_buffer": app_module.trade_writer.stats(),
+        "status_cache": app_module.status_cache.stats(),
+        "top_queries": app_module.query_stats.stats(limit=5)["queries"],
+    }
+
+
+def print_report(report):
+    print(f"Запросов: {report['requests']} за {report['elapsed_seconds']} с ({report['rps']} rps), "
+          f"подготовка {report['setup_seconds']} с")
+    print(f"{'маршрут':<22}{'запр.':>8}{'rps':>9}{'ош.':>6}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}"
+          f"{'max мс':>9}{'SQL/запр':>10}")
+    for route, r in report["routes"].items():
+        print(f"{route:<22}{r['requests']:>8}{r['rps']:>9}{r['errors']:>6}{r['p50_ms']:>9}{r['p95_ms']:>9}"
+              f"{r['p99_ms']:>9}{r['max_ms']:>9}{r['sql_per_request']:>10}")
+    print("Память и очередь записи:")
+    for sample in report["memory"]:
+        print(f"  t={sample['t']:>6} с  RSS {sample['rss_mb']:>7} МБ  агентов {sample['agents']:>4}  "
+              f"в буфере {sample['write_pending']:>6}  точек в кэше {sample['cache_points']}")
+    print("Самые дорогие запросы:")
+    for query in report["top_queries"]:
+        print(f"  {query['total_ms']:>10} мс  {query['calls']:>7} вызовов  {query['query'][:90]}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run(args)
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.max_p95_ms is not None:
+        slow = {route: r["p95_ms"] for route, r in report["routes"].items() if r["p95_ms"] > args.max_p95_ms}
+        if slow:
+            print(f"p95 выше {args.max_p95_ms} мс: {slow}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
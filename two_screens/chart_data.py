@@ -0,0 +1,142 @@
+"""
+Параметры и формат ответа /chart_data (PnL всех задач) для app.py и asgi_app.py.
+
+Ответ всегда ограничен по размеру, агрегирование – на стороне базы:
+  mode=series (по умолчанию) – средний PnL по max_points группам задач подряд по id;
+                               ответ – массив чисел, как раньше (input.html не меняется);
+  mode=histogram             – распределение PnL по bins корзинам;
+  mode=page                  – строки задач по id (курсор after_id, limit).
+from, to (миллисекунды) – окно по tasks.start_time. Результаты кэшируются на CHART_CACHE_TTL сек.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from status_view import from_ms, to_ms
+
+CHART_MODES = ("series", "histogram", "page")
+DEFAULT_POINTS, MAX_POINTS = 500, 2000
+DEFAULT_BINS, MAX_BINS = 20, 200
+DEFAULT_PAGE, MAX_PAGE = 200, 1000
+
+# size – max_points, bins или limit в зависимости от mode
+ChartQuery = namedtuple("ChartQuery", "mode start end size after_id")
+
+
+def _bounded(value, default, maximum):
+    if value is None:
+        return default
+    if value < 1:
+        raise ValueError("значение должно быть положительным")
+    return min(value, maximum)
+
+
+def parse_chart_args(args):
+    """request.args -> ChartQuery (ключ кэша); ValueError при неверных параметрах."""
+    mode = args.get("mode", "series")
+    if mode not in CHART_MODES:
+        raise ValueError(f"mode: одно из {', '.join(CHART_MODES)}")
+    start = args.get("from", type=int)
+    end = args.get("to", type=int)
+    if start is not None and end is not None and start >= end:
+        raise ValueError("from должен быть меньше to")
+    if mode == "series":
+        size = _bounded(args.get("max_points", type=int), DEFAULT_POINTS, MAX_POINTS)
+    elif mode == "histogram":
+        size = _bounded(args.get("bins", type=int), DEFAULT_BINS, MAX_BINS)
+    else:
+        size = _bounded(args.get("limit", type=int), DEFAULT_PAGE, MAX_PAGE)
+    after_id = args.get("after_id", 0, type=int) if mode == "page" else None
+    return ChartQuery(mode, start, end, size, after_id)
+
+
+def query_window(query):
+    """(start, end) как datetime или None для условий по tasks.start_time."""
+    return (None if query.start is None else from_ms(query.start),
+            None if query.end is None else from_ms(query.end))
+
+
+def window_conditions(query):
+    """Условия и параметры окна по tasks.start_time."""
+    conditions, params = [], []
+    start, end = query_window(query)
+    if start is not None:
+        conditions.append("start_time >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("start_time < %s")
+        params.append(end)
+    return conditions, params
+
+
+def where_sql(conditions):
+    return " WHERE " + " AND ".join(conditions) if conditions else ""
+
+
+def series_step(lo_id, hi_id, max_points):
+    """Сколько id подряд усредняется в одну точку, чтобы точек было не больше max_points."""
+    return max(1, -(-(hi_id - lo_id + 1) // max_points))
+
+
+def histogram_width(lo, hi, bins):
+    return (hi - lo) / bins if hi > lo else 1.0
+
+
+def histogram_counts(rows, bins):
+    """(номер корзины, количество) -> список из bins счётчиков; максимум – в последнюю корзину."""
+    counts = [0] * bins
+    for bucket, n in rows:
+        if bucket is not None:
+            counts[min(int(bucket), bins - 1)] += n
+    return counts
+
+
+def chart_payload(query, result):
+    """Результат storage.chart_data(query) -> JSON-ответ."""
+    if query.mode == "series":
+        return result
+    if query.mode == "histogram":
+        lo, width, counts, total = result
+        return {
+            "count": total,
+            "bins": [[round(lo + i * width, 2), round(lo + (i + 1) * width, 2), n]
+                     for i, n in enumerate(counts)],
+        }
+    items = [[row_id, pnl, to_ms(start_time) if start_time else None] for row_id, pnl, start_time in result]
+    return {
+        "items": items,
+        "next_after_id": items[-1][0] if len(items) == query.size else None,
+    }
+
+
+class ResponseCache:
+    """Небольшой LRU-кэш ответов с TTL (агрегаты по всем задачам меняются медленно)."""
+
+    def __init__(self, ttl=10, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
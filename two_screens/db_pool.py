@@ -0,0 +1,234 @@
+import threading
+import time
+from collections import deque
+
+import pymysql
+
+
+class PoolTimeout(Exception):
+    """Не удалось получить соединение из пула за отведённое время."""
+
+
+class PooledConnection:
+    """
+    Обёртка над соединением PyMySQL.
+    close() не закрывает TCP-соединение, а возвращает его в пул,
+    поэтому существующий код (conn.close() в finally) работает без изменений.
+    """
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise pymysql.err.InterfaceError("Соединение уже возвращено в пул")
+        return getattr(self._raw, name)
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw, self._created_at)
+
+    def discard(self):
+        """Закрыть соединение, не возвращая в пул (например, с недочитанным серверным курсором)."""
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw, self._created_at, reuse=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    Ограниченный потокобезопасный пул соединений MySQL.
+
+      min_size      – сколько соединений держим открытыми заранее;
+      max_size      – больше этого числа соединений одновременно не открываем;
+      max_idle      – соединение, простоявшее дольше (сек), пересоздаётся;
+      max_lifetime  – соединение старше (сек) пересоздаётся независимо от нагрузки;
+      ping_after    – если соединение простаивало дольше (сек), проверяем его ping();
+      timeout       – сколько ждать свободного соединения, прежде чем PoolTimeout.
+    """
+
+    def __init__(self, connect_kwargs, min_size=2, max_size=10, max_idle=300,
+                 max_lifetime=3600, ping_after=30, timeout=10):
+        if min_size > max_size:
+            raise ValueError("min_size не может быть больше max_size")
+        self._connect_kwargs = dict(connect_kwargs)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+        self.timeout = timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()  # (raw, created_at, released_at)
+        self._size = 0        # открытые соединения: свободные + выданные
+        self._in_use = 0
+
+        # Счётчики для /pool_stats
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._recycled = 0
+        self._broken = 0
+
+        self._fill()
+
+    def _connect(self):
+        raw = pymysql.connect(**self._connect_kwargs)
+        with self._cond:
+            self._created += 1
+        return raw, time.monotonic()
+
+    def _fill(self):
+        """Открываем min_size соединений заранее (ошибки не фатальны)."""
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                raw, created_at = self._connect()
+            except Exception as e:
+                with self._cond:
+                    self._size -= 1
+                print(f"Ошибка подключения к MySQL (пул): {e}")
+                return
+            with self._cond:
+                self._idle.append((raw, created_at, time.monotonic()))
+                self._cond.notify()
+
+    def _is_stale(self, created_at, released_at, now):
+        return (now - created_at > self.max_lifetime or
+                now - released_at > self.max_idle)
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Выдаёт PooledConnection; при исчерпании пула ждёт до timeout секунд."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    item = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    item = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"Нет свободных соединений за {self.timeout} с")
+                waited = True
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                wait_time = time.monotonic() - started
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        try:
+            raw, created_at = self._checkout(item)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, raw, created_at)
+
+    def _checkout(self, item):
+        """Проверка живости выданного соединения; устаревшие/мёртвые пересоздаём."""
+        if item is None:
+            return self._connect()
+        raw, created_at, released_at = item
+        now = time.monotonic()
+        if self._is_stale(created_at, released_at, now):
+            self._discard(raw)
+            with self._cond:
+                self._recycled += 1
+            return self._connect()
+        if now - released_at > self.ping_after:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                self._discard(raw)
+                with self._cond:
+                    self._broken += 1
+                return self._connect()
+        return raw, created_at
+
+    def release(self, raw, created_at, reuse=True):
+        """
+        Возврат соединения в пул. Незакоммиченную транзакцию откатываем,
+        чтобы следующий пользователь не получил чужой снимок данных.
+        reuse=False – соединение закрывается, в пуле освобождается место.
+        """
+        keep = reuse
+        if not reuse:
+            self._discard(raw)
+        else:
+            try:
+                raw.rollback()
+            except Exception:
+                keep = False
+                self._discard(raw)
+        now = time.monotonic()
+        if keep and now - created_at > self.max_lifetime:
+            keep = False
+            self._discard(raw)
+        with self._cond:
+            self._in_use -= 1
+            if keep:
+                self._idle.append((raw, created_at, now))
+            else:
+                self._size -= 1
+                self._recycled += 1
+            self._cond.notify()
+
+    def close_all(self):
+        """Закрывает все свободные соединения (выданные закроются при возврате)."""
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+        for raw, _, _ in idle:
+            self._discard(raw)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total": round(self._wait_time_total, 6),
+                "wait_time_avg": round(self._wait_time_total / self._waits, 6) if self._waits else 0.0,
+                "wait_time_max": round(self._wait_time_max, 6),
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "recycled": self._recycled,
+                "broken": self._broken,
+            }
@@ -0,0 +1,55 @@
+"""
+Прореживание временных рядов для графиков.
+
+lttb() – Largest-Triangle-Three-Buckets (Sveinn Steinarsson, 2013):
+сохраняет форму кривой (пики и провалы) и первую/последнюю точки,
+работает за один проход O(n) по массиву точек [t, y].
+"""
+
+
+def lttb(points, max_points):
+    """
+    points     – список [t, y], отсортированный по t;
+    max_points – сколько точек оставить (>= 3), иначе ряд возвращается как есть.
+    """
+    n = len(points)
+    if max_points is None or max_points < 3 or n <= max_points:
+        return points
+
+    sampled = [points[0]]
+    bucket_size = (n - 2) / (max_points - 2)
+    a = 0  # индекс последней выбранной точки
+
+    for i in range(max_points - 2):
+        # Границы текущей корзины
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+
+        # Средняя точка следующей корзины – третья вершина треугольника
+        next_start = end
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        count = next_end - next_start
+        avg_t = 0.0
+        avg_y = 0.0
+        for t, y in points[next_start:next_end]:
+            avg_t += t
+            avg_y += y
+        avg_t /= count
+        avg_y /= count
+
+        # Выбираем в текущей корзине точку с максимальной площадью треугольника
+        a_t, a_y = points[a]
+        max_area = -1.0
+        max_index = start
+        for j in range(start, end):
+            t, y = points[j]
+            area = abs((a_t - avg_t) * (y - a_y) - (a_t - t) * (avg_y - a_y))
+            if area > max_area:
+                max_area = area
+                max_index = j
+
+        sampled.append(points[max_index])
+        a = max_index
+
+    sampled.append(points[-1])
+    return sampled
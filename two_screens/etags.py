@@ -0,0 +1,45 @@
+"""
+Условные GET для опрашиваемых эндпоинтов (/status_data, /chart_data).
+
+ETag строится из дешёвой версии данных (последняя сделка, PnL, статус ...) и
+параметров запроса; совпадение с If-None-Match даёт 304 без чтения данных и
+сериализации JSON. ETag слабый: uptime в ответе считается в момент запроса
+и на клиенте всё равно тикает сам.
+"""
+import hashlib
+from datetime import datetime
+
+# Ответ на каждый опрос перепроверяется браузером (If-None-Match), но не берётся из кэша молча
+CACHE_CONTROL = "no-cache"
+
+
+def make_etag(*parts):
+    """Непрозрачный тег из частей версии (без кавычек и W/)."""
+    return hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def status_version(status, pnl, total_fee, last_time):
+    """
+    Версия состояния задачи для /status_data – одинаковая из status_cache и из БД
+    (storage.task_version), иначе первый опрос после заполнения или вытеснения кэша
+    не совпадал бы с If-None-Match. last_time – последняя сделка: мс, datetime
+    или текст (MAX() в SQLite); None – сделок нет.
+    """
+    if isinstance(last_time, str):
+        last_time = datetime.fromisoformat(last_time)
+    if isinstance(last_time, datetime):
+        last_time = int(last_time.timestamp() * 1000)
+    return status, round(float(pnl or 0), 2), round(float(total_fee or 0), 2), last_time or 0
+
+
+def not_modified(response_class, tag):
+    response = response_class(status=304)
+    response.set_etag(tag, weak=True)
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
+
+
+def with_etag(response, tag):
+    response.set_etag(tag, weak=True)
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    return response
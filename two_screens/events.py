@@ -0,0 +1,106 @@
+"""
+Рассылка событий статуса подписчикам (Server-Sent Events).
+
+Симулятор публикует дельту один раз за тик, брокер раскладывает её по очередям
+всех открытых дашбордов этой задачи – без запросов в БД на каждого зрителя.
+"""
+import asyncio
+import queue
+import threading
+
+from fast_json import dumps
+
+
+class Subscription:
+    """Очередь событий одного подключённого клиента."""
+
+    def __init__(self, task_id, maxsize):
+        self.task_id = task_id
+        self.queue = queue.Queue(maxsize=maxsize)
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Клиент не успевает читать: выбрасываем накопленное и просим
+            # его перечитать состояние через /status_data?since=...
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self.queue.put_nowait({"type": "reset"})
+            except queue.Full:
+                pass
+
+    def get(self, timeout):
+        """Следующее событие или None, если за timeout секунд ничего не пришло."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription:
+    """То же для asgi_app.py: очередь asyncio, публикация из того же event loop."""
+
+    def __init__(self, task_id, maxsize):
+        self.task_id = task_id
+        self.queue = asyncio.Queue(maxsize=maxsize)
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "reset"})
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBroker:
+    def __init__(self, queue_size=100, subscription_class=Subscription):
+        self.queue_size = queue_size
+        self._subscription_class = subscription_class
+        self._lock = threading.Lock()
+        self._subscribers = {}  # task_id -> set(Subscription)
+
+    def subscribe(self, task_id):
+        sub = self._subscription_class(task_id, self.queue_size)
+        with self._lock:
+            self._subscribers.setdefault(task_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.task_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.task_id]
+
+    def has_subscribers(self, task_id):
+        # Чтение без блокировки: худший случай – одно лишнее/пропущенное событие,
+        # которое клиент всё равно наверстает по курсору since
+        return task_id in self._subscribers
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def publish(self, task_id, event):
+        with self._lock:
+            subs = list(self._subscribers.get(task_id, ()))
+        for sub in subs:
+            sub.push(event)
+
+
+def format_sse(event):
+    """Кадр text/event-stream."""
+    return f"event: {event.get('type', 'message')}\ndata: {dumps(event)}\n\n"
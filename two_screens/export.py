@@ -0,0 +1,103 @@
+"""
+Потоковая выгрузка trade_logs (/export/trades) в NDJSON или CSV.
+
+Хранилище отдаёт сделки пачками (storage.iter_trade_chunks): в MySQL – через
+небуферизованный серверный курсор, в SQLite – страницами по (log_time, id).
+Форматтеры превращают каждую пачку в один кусок ответа, поэтому память
+не зависит от объёма выгрузки.
+"""
+import csv
+import io
+import json
+
+from status_view import from_ms
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+EXPORT_COLUMNS = ("id", "task_id", "log_time", "symbol", "side", "amount", "pnl_change")
+EXPORT_CHUNK_ROWS = 1000
+
+TRADES_EXPORT_QUERY = """
+    SELECT id, task_id, log_time, symbol, side, amount, pnl_change
+    FROM trade_logs{where}
+    ORDER BY log_time, id{limit}
+"""
+
+
+def parse_export_args(args):
+    """
+    request.args -> (формат, task_id, start, end). Нужен task_id или окно from/to
+    (миллисекунды); без task_id выгружаются сделки всех задач за окно.
+    """
+    fmt = args.get("format", "ndjson")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format: одно из {', '.join(EXPORT_FORMATS)}")
+    task_id = args.get("task_id", type=int)
+    start = args.get("from", type=int)
+    end = args.get("to", type=int)
+    if task_id is None and (start is None or end is None):
+        raise ValueError("нужен task_id или окно from и to")
+    return (fmt, task_id,
+            None if start is None else from_ms(start),
+            None if end is None else from_ms(end))
+
+
+def export_conditions(task_id=None, start=None, end=None):
+    """Условия выгрузки: сделки задачи и/или окно по log_time (datetime)."""
+    conditions, params = [], []
+    if task_id is not None:
+        conditions.append("task_id = %s")
+        params.append(task_id)
+    if start is not None:
+        conditions.append("log_time >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("log_time < %s")
+        params.append(end)
+    return conditions, params
+
+
+def _record(row):
+    row_id, task_id, log_time, symbol, side, amount, pnl_change = row
+    return (row_id, task_id, log_time.strftime("%Y-%m-%d %H:%M:%S"), symbol, side,
+            float(amount), float(pnl_change))
+
+
+def ndjson_chunk(rows):
+    return "".join(json.dumps(dict(zip(EXPORT_COLUMNS, _record(row))), ensure_ascii=False) + "\n"
+                   for row in rows)
+
+
+def csv_chunk(rows, header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows(_record(row) for row in rows)
+    return buffer.getvalue()
+
+
+def format_chunks(chunks, fmt):
+    """Пачки строк -> куски тела ответа (генератор для Flask)."""
+    if fmt == "csv":
+        yield csv_chunk((), header=True)
+        for rows in chunks:
+            yield csv_chunk(rows)
+    else:
+        for rows in chunks:
+            yield ndjson_chunk(rows)
+
+
+async def aformat_chunks(chunks, fmt):
+    """То же для асинхронного итератора пачек (asgi_app.py)."""
+    if fmt == "csv":
+        yield csv_chunk((), header=True)
+    async for rows in chunks:
+        yield csv_chunk(rows) if fmt == "csv" else ndjson_chunk(rows)
+
+
+def export_filename(fmt, task_id=None):
+    name = f"trades_task_{task_id}" if task_id is not None else "trades"
+    return f"{name}.{fmt}"
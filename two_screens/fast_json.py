@@ -0,0 +1,115 @@
+"""
+Быстрая сериализация JSON и сжатие ответов для app.py и asgi_app.py.
+
+OrjsonProvider – jsonify() через orjson (если установлен; иначе стандартный json):
+Decimal и datetime сериализуются без промежуточных преобразований, результат сразу в байтах.
+compress_response() – gzip или brotli (если установлен модуль brotli) для ответов
+крупнее COMPRESS_MIN_SIZE, по заголовку Accept-Encoding клиента.
+"""
+import gzip
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli необязателен
+    brotli = None
+
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_MIMETYPES = {"application/json", "text/html", "text/csv", "application/x-ndjson"}
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(" ") if isinstance(value, datetime) else value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_bytes(obj):
+    """JSON в UTF-8 без пробелов; orjson, если доступен."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode()
+
+
+def dumps(obj):
+    return dumps_bytes(obj).decode()
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON-провайдер Flask/Quart: app.json = OrjsonProvider(app)."""
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # Нестандартные параметры (sort_keys, indent ...) – через json
+            return super().dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+
+def choose_encoding(accept_encodings):
+    """Кодировка по Accept-Encoding (werkzeug request.accept_encodings): br, gzip или None."""
+    if brotli is not None and accept_encodings["br"]:
+        return "br"
+    if accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress_body(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def should_compress(response, streamed):
+    """Сжимаем только готовые (не потоковые) успешные ответы текстовых типов."""
+    return (response.status_code == 200
+            and not streamed
+            and "Content-Encoding" not in response.headers
+            and response.mimetype in COMPRESS_MIMETYPES)
+
+
+def apply_compression(response, data, encoding):
+    response.vary.add("Accept-Encoding")
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(compress_body(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def compress_response(response, accept_encodings):
+    """Для after_request во Flask."""
+    if not should_compress(response, response.is_streamed):
+        return response
+    return apply_compression(response, response.get_data(), choose_encoding(accept_encodings))
+
+
+async def compress_quart_response(response, accept_encodings):
+    """То же для Quart: тело читается асинхронно, потоковые тела – не DataBody."""
+    from quart.wrappers.response import DataBody
+
+    if not should_compress(response, not isinstance(response.response, DataBody)):
+        return response
+    return apply_compression(response, await response.get_data(), choose_encoding(accept_encodings))
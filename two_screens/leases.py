@@ -0,0 +1,164 @@
+"""
+Аренды агентов в БД (таблица agent_leases): запуск two_screens на нескольких узлах.
+
+Агент тикает только на узле (процессе), который держит его аренду. LeaseKeeper
+в фоновом потоке раз в ttl/3 продлевает аренды своего узла, а на свободные места
+(capacity) пачками забирает просроченные – агентов упавших или остановленных узлов.
+После рестарта узлов просроченных аренд может быть тысячи: пока они есть, пачки
+забираются чаще, но не быстрее claim_rate агентов в секунду.
+Если продлить аренду не удалось за ttl (узел отрезан от БД), holds() возвращает
+False и тики пропускаются ещё до того, как аренду заберёт другой узел, – один
+агент не тикает на двух узлах одновременно.
+"""
+import threading
+import time
+
+
+class LeaseKeeper:
+    """
+      renew      – renew(node_id, ttl) -> [task_id]: продлить аренды узла (storage.renew_leases);
+      claim      – claim(node_id, ttl, limit) -> [task_id]: забрать просроченные (storage.claim_leases);
+      on_claim   – on_claim([task_id, ...]): аренды получены, запустить агентов (пачкой);
+      on_lost    – on_lost(task_id): аренда у другого узла или снята, остановить агента локально;
+      running    – running() -> int: сколько агентов уже работает на узле;
+      ttl        – срок аренды, сек;
+      capacity   – больше стольких агентов узел не забирает;
+      batch_size – сколько просроченных аренд забирать за один проход;
+      claim_rate – предел скорости захвата, агентов в секунду.
+    """
+
+    def __init__(self, renew, claim, node_id, on_claim, on_lost, running,
+                 ttl=30.0, capacity=1000, batch_size=50, claim_rate=50.0):
+        self._renew = renew
+        self._claim = claim
+        self.node_id = node_id
+        self._on_claim = on_claim
+        self._on_lost = on_lost
+        self._running = running
+        self.ttl = ttl
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.claim_rate = claim_rate
+
+        self._lock = threading.Lock()
+        self._held = {}  # task_id -> monotonic-время, до которого аренда точно наша
+        self._added = set()  # add() до COMMIT аренды: продление её ещё не видело
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="lease-keeper", daemon=True)
+
+        self.claimed = 0
+        self.lost = 0
+        self.failures = 0
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, task_id):
+        """
+        Аренда создаётся этим узлом (задача с арендой, storage.create_task) – вызывать до COMMIT:
+        иначе продление увидит незнакомую аренду узла и запустит агента как забранного.
+        Пока продление аренду не подтвердило, она не считается потерянной (до ttl).
+        """
+        with self._lock:
+            self._held[task_id] = time.monotonic() + self.ttl
+            self._added.add(task_id)
+
+    def discard(self, task_id):
+        """Агент снят с узла – аренду больше не отслеживаем."""
+        with self._lock:
+            self._held.pop(task_id, None)
+            self._added.discard(task_id)
+
+    def holds(self, task_id):
+        """Можно ли тикать агенту: аренда наша и подтверждена базой не дольше ttl назад."""
+        with self._lock:
+            return self._held.get(task_id, 0.0) > time.monotonic()
+
+    def held(self):
+        with self._lock:
+            return len(self._held)
+
+    def close(self, timeout=10):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            delay = self.ttl / 3
+            if self._step():
+                # Забрали полную пачку – вероятно, ждут ещё; следующая пачка – по claim_rate
+                delay = min(delay, self.batch_size / self.claim_rate)
+            if self._stop.wait(delay):
+                return
+
+    def _step(self):
+        """Продление и захват; True, если просроченных аренд, похоже, больше, чем забрали."""
+        started = time.monotonic()
+        try:
+            renewed = set(self._renew(self.node_id, self.ttl))
+        except Exception as e:
+            self.failures += 1
+            print(f"Ошибка продления аренд узла {self.node_id}: {e}")
+            return False
+        with self._lock:
+            lost = []
+            for task_id, valid_until in list(self._held.items()):
+                if task_id in renewed:
+                    self._held[task_id] = started + self.ttl
+                    self._added.discard(task_id)
+                elif task_id in self._added:
+                    # Транзакция с арендой могла ещё не завершиться; не подтвердилась за ttl – не наша
+                    if valid_until < started:
+                        del self._held[task_id]
+                        self._added.discard(task_id)
+                        lost.append(task_id)
+                elif valid_until - self.ttl < started:
+                    # Добавлена до продления, но в базе уже не наша – перехвачена или снята
+                    del self._held[task_id]
+                    lost.append(task_id)
+            # Аренды узла, о которых он не знает (например, агент не запустился), – запускаем
+            claimed = [task_id for task_id in renewed if task_id not in self._held]
+            for task_id in claimed:
+                self._held[task_id] = started + self.ttl
+
+        free = self.capacity - self._running() - len(claimed)
+        limit = min(free, self.batch_size)
+        fresh = []
+        if limit > 0:
+            started = time.monotonic()
+            try:
+                fresh = self._claim(self.node_id, self.ttl, limit)
+            except Exception as e:
+                self.failures += 1
+                print(f"Ошибка захвата аренд узлом {self.node_id}: {e}")
+            with self._lock:
+                for task_id in fresh:
+                    self._held[task_id] = started + self.ttl
+            claimed += fresh
+
+        self.lost += len(lost)
+        self.claimed += len(claimed)
+        for task_id in lost:
+            self._notify(self._on_lost, task_id)
+        if claimed:
+            self._notify(self._on_claim, claimed)
+        return limit > 0 and len(fresh) == limit
+
+    @staticmethod
+    def _notify(callback, arg):
+        try:
+            callback(arg)
+        except Exception as e:
+            print(f"Ошибка обработки аренд ({arg}): {e}")
+
+    def stats(self):
+        return {
+            "node_id": self.node_id,
+            "held": self.held(),
+            "capacity": self.capacity,
+            "ttl": self.ttl,
+            "claimed": self.claimed,
+            "lost": self.lost,
+            "failures": self.failures,
+        }
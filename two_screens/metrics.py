@@ -0,0 +1,186 @@
+"""
+Метрики two_screens в текстовом формате Prometheus (/metrics).
+
+  – гистограммы длительности запросов по маршрутам (+ оценки p50/p95/p99);
+  – сколько SQL-запросов выполнил каждый HTTP-запрос и сколько времени они заняли;
+  – произвольные gauge (активные агенты, подписчики SSE, пул соединений ...).
+
+SQL привязывается к HTTP-запросу через contextvars: работает и для потоков Flask,
+и для задач asyncio в asgi_app.py. Запросы фоновых потоков (буфер записи,
+планировщик) попадают только в общие счётчики.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# [кол-во SQL, суммарное время SQL] текущего HTTP-запроса
+_request_sql = ContextVar("request_sql", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя ячейка – +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля линейной интерполяцией внутри корзины (как histogram_quantile)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    def __init__(self, prefix="two_screens"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}  # name -> (help, buckets, {labels: Histogram})
+        self._counters = {}    # name -> (help, {labels: value})
+        self._gauges = []      # (name, help, fn) ; fn() -> число или {labels: число}
+
+    # --- регистрация и запись ---
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            self._histograms.setdefault(self.prefix + "_" + name, (help_text, buckets, {}))
+
+    def observe(self, name, value, labels=()):
+        with self._lock:
+            _, buckets, series = self._histograms[self.prefix + "_" + name]
+            hist = series.get(labels)
+            if hist is None:
+                hist = series[labels] = Histogram(buckets)
+            hist.observe(value)
+
+    def counter(self, name, help_text):
+        with self._lock:
+            self._counters.setdefault(self.prefix + "_" + name, (help_text, {}))
+
+    def inc(self, name, value=1, labels=()):
+        with self._lock:
+            series = self._counters[self.prefix + "_" + name][1]
+            series[labels] = series.get(labels, 0) + value
+
+    def gauge(self, name, help_text, fn):
+        self._gauges.append((self.prefix + "_" + name, help_text, fn))
+
+    def series(self, name):
+        """{labels: (count, sum)} гистограммы name – для отчётов (benchmark.py)."""
+        with self._lock:
+            _, _, series = self._histograms[self.prefix + "_" + name]
+            return {labels: (hist.count, hist.sum) for labels, hist in series.items()}
+
+    # --- HTTP-запросы ---
+
+    def begin_request(self):
+        """Вызывать в before_request: открывает счётчик SQL текущего запроса."""
+        _request_sql.set([0, 0.0])
+        return time.perf_counter()
+
+    def end_request(self, started, route, method, status):
+        """Вызывать в after_request."""
+        duration = time.perf_counter() - started
+        sql = _request_sql.get() or [0, 0.0]
+        _request_sql.set(None)
+        labels = (("route", route), ("method", method))
+        self.observe("http_request_duration_seconds", duration, labels)
+        self.observe("http_request_sql_queries", sql[0], labels)
+        self.observe("http_request_sql_duration_seconds", sql[1], labels)
+        self.inc("http_requests_total", 1, labels + (("status", status),))
+
+    def on_query(self, query, params, duration, rows):
+        """Слушатель storage: каждый SQL-запрос."""
+        current = _request_sql.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += duration
+        self.observe("sql_query_duration_seconds", duration)
+
+    # --- вывод ---
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (help_text, buckets, series) in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, hist in sorted(series.items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets + (float("inf"),), hist.counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_number(hist.sum)}")
+                    lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+                # Оценки квантилей рядом с гистограммой – чтобы видеть p50/p95/p99 без PromQL
+                if series:
+                    lines.append(f"# HELP {name}_quantile {help_text} (оценка по корзинам)")
+                    lines.append(f"# TYPE {name}_quantile gauge")
+                    for labels, hist in sorted(series.items()):
+                        for q in QUANTILES:
+                            value = hist.quantile(q)
+                            lines.append(f"{name}_quantile{_labels(labels + (('quantile', q),))} {_number(value)}")
+            for name, (help_text, series) in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for name, help_text, fn in self._gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for labels, item in sorted(value.items()):
+                    lines.append(f"{name}{_labels(labels)} {_number(item)}")
+            else:
+                lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def create_metrics():
+    """Набор метрик, общий для app.py и asgi_app.py."""
+    metrics = Metrics()
+    metrics.histogram("http_request_duration_seconds", "Длительность HTTP-запросов по маршрутам")
+    metrics.histogram("http_request_sql_queries", "Количество SQL-запросов на HTTP-запрос", COUNT_BUCKETS)
+    metrics.histogram("http_request_sql_duration_seconds", "Суммарное время SQL на HTTP-запрос")
+    metrics.histogram("sql_query_duration_seconds", "Длительность отдельных SQL-запросов")
+    metrics.counter("http_requests_total", "HTTP-запросы по маршрутам и кодам ответа")
+    return metrics
@@ -0,0 +1,326 @@
+"""
+Версионные миграции схемы two_screens.
+
+Каждая миграция – (версия, описание, [SQL...]) либо, если SQL различается,
+(версия, описание, {"mysql": [...], "sqlite": [...]}). Применённые версии хранятся
+в таблице schema_migrations, поэтому на существующих инсталляциях
+выполняются только новые шаги. Параллельный старт нескольких процессов MySQL
+сериализуется через GET_LOCK.
+
+Запуск вручную:  python migrations.py   – применить миграции и проверить планы запросов.
+Долгие шаги (заполнение свёрток в миграции 3 на большой trade_logs) лучше выполнять
+так, отдельным шагом деплоя, а воркеры запускать с DB_MIGRATE_ON_START=0 – тогда они
+только проверяют версию схемы (require_current) и не ждут чужую миграцию под GET_LOCK.
+"""
+from datetime import datetime
+
+_ROLLUPS_TABLE = """
+        CREATE TABLE IF NOT EXISTS trade_rollups (
+            task_id INT NOT NULL,
+            resolution INT NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            open_pnl DECIMAL(12,2),
+            close_pnl DECIMAL(12,2),
+            min_pnl DECIMAL(12,2),
+            max_pnl DECIMAL(12,2),
+            close_time DATETIME,
+            trades INT,
+            volume DECIMAL(14,2),
+            PRIMARY KEY (task_id, resolution, bucket_start)
+        )"""
+
+# Кумулятивный PnL по сделкам (окно), затем группировка по интервалам;
+# close – нарастающая сумма по интервалам, open = close - изменение за интервал
+_ROLLUPS_BACKFILL = """
+        INSERT INTO trade_rollups (task_id, resolution, bucket_start, open_pnl, close_pnl,
+                                   min_pnl, max_pnl, close_time, trades, volume)
+        SELECT task_id, {resolution}, bucket,
+               SUM(SUM(pnl_change)) OVER (PARTITION BY task_id ORDER BY bucket) - SUM(pnl_change),
+               SUM(SUM(pnl_change)) OVER (PARTITION BY task_id ORDER BY bucket),
+               MIN(cumulative), MAX(cumulative), MAX(log_time), COUNT(*), SUM(amount)
+        FROM (
+            SELECT task_id, log_time, amount, pnl_change, {bucket} AS bucket,
+                   SUM(pnl_change) OVER (PARTITION BY task_id ORDER BY log_time, id
+                                         ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS cumulative
+            FROM trade_logs{where}
+        ) t
+        GROUP BY task_id, bucket
+        """
+
+_ROLLUP_BUCKETS = {
+    "mysql": ((60, "DATE_FORMAT(log_time, '%Y-%m-%d %H:%i:00')"),
+              (3600, "DATE_FORMAT(log_time, '%Y-%m-%d %H:00:00')")),
+    "sqlite": ((60, "strftime('%Y-%m-%d %H:%M:00', log_time)"),
+               (3600, "strftime('%Y-%m-%d %H:00:00', log_time)")),
+}
+
+
+def rollup_backfill(dialect, where=""):
+    """
+    Свёртки trade_rollups из trade_logs одним INSERT ... SELECT на разрешение:
+    миграция 3 и пересборка после массовой загрузки (backtest.py).
+    where – условие на trade_logs без параметров (в SQL есть % форматов дат).
+    """
+    return [_ROLLUPS_BACKFILL.format(resolution=resolution, bucket=bucket, where=where)
+            for resolution, bucket in _ROLLUP_BUCKETS[dialect]]
+
+
+_LEASES_TABLE = """
+        CREATE TABLE IF NOT EXISTS agent_leases (
+            task_id INT PRIMARY KEY,
+            node_id VARCHAR(128) NOT NULL,
+            expires_at DATETIME NOT NULL
+        )"""
+
+# Задачи, запущенные до миграции, получают просроченную аренду – их заберёт первый свободный узел
+_LEASES_STEPS = [
+    "CREATE INDEX idx_agent_leases_expires ON agent_leases (expires_at)",
+    "CREATE INDEX idx_agent_leases_node ON agent_leases (node_id)",
+    """
+        INSERT INTO agent_leases (task_id, node_id, expires_at)
+        SELECT id, '', '1970-01-01 00:00:00' FROM tasks WHERE status = 'в обробці'
+        """,
+]
+
+MIGRATIONS = [
+    (1, "Базовые таблицы tasks и trade_logs", {"mysql": [
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            number INT,
+            slider_value DECIMAL(10,2),
+            period VARCHAR(50),
+            status VARCHAR(255),
+            agent_name VARCHAR(50),
+            start_time DATETIME,
+            pnl DECIMAL(10,2) DEFAULT 0,
+            total_fee DECIMAL(10,2) DEFAULT 0
+        ) ENGINE=InnoDB
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS trade_logs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            task_id INT,
+            log_time DATETIME,
+            symbol VARCHAR(20),
+            side VARCHAR(10),
+            amount DECIMAL(10,2),
+            pnl_change DECIMAL(10,2)
+        ) ENGINE=InnoDB
+        """,
+    ], "sqlite": [
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            number INT,
+            slider_value DECIMAL(10,2),
+            period VARCHAR(50),
+            status VARCHAR(255),
+            agent_name VARCHAR(50),
+            start_time DATETIME,
+            pnl DECIMAL(10,2) DEFAULT 0,
+            total_fee DECIMAL(10,2) DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS trade_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INT,
+            log_time DATETIME,
+            symbol VARCHAR(20),
+            side VARCHAR(10),
+            amount DECIMAL(10,2),
+            pnl_change DECIMAL(10,2)
+        )
+        """,
+    ]}),
+    (2, "trade_logs: индекс (task_id, log_time) для лога, графика и курсора since", [
+        "CREATE INDEX idx_trade_logs_task_time ON trade_logs (task_id, log_time)",
+    ]),
+    (3, "trade_rollups: минутные и часовые свёртки кумулятивного PnL (+ заполнение из trade_logs)", {
+        "mysql": [_ROLLUPS_TABLE + " ENGINE=InnoDB"] + rollup_backfill("mysql"),
+        "sqlite": [_ROLLUPS_TABLE] + rollup_backfill("sqlite"),
+    }),
+    (4, "tasks: индекс start_time для окна по времени в /chart_data", [
+        "CREATE INDEX idx_tasks_start_time ON tasks (start_time)",
+    ]),
+    (5, "trade_logs: индекс log_time для выгрузки сделок за период (/export/trades)", [
+        "CREATE INDEX idx_trade_logs_time ON trade_logs (log_time)",
+    ]),
+    (6, "agent_leases: аренды агентов узлами (+ просроченные аренды для уже запущенных задач)", {
+        "mysql": [_LEASES_TABLE + " ENGINE=InnoDB"] + _LEASES_STEPS,
+        "sqlite": [_LEASES_TABLE] + _LEASES_STEPS,
+    }),
+    (7, "tasks: seed потока сделок агента (NULL – поток по id задачи)", [
+        "ALTER TABLE tasks ADD COLUMN seed BIGINT",
+    ]),
+    (8, "tasks: очередь запусков – индекс status для места в очереди (+ аренды ожидающих задач)", [
+        "CREATE INDEX idx_tasks_status ON tasks (status, id)",
+        # Ожидавшие запуска без аренды (очередь только в памяти процесса) забирает первый свободный узел
+        """
+        INSERT INTO agent_leases (task_id, node_id, expires_at)
+        SELECT id, '', '1970-01-01 00:00:00' FROM tasks
+        WHERE status = 'в черзі' AND id NOT IN (SELECT task_id FROM agent_leases)
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+LOCK_NAME = "two_screens_migrations"
+
+# Горячие запросы status_data и simulate_trading, которые должны обслуживаться индексом.
+# (описание, SQL с плейсхолдером %s для task_id)
+HOT_QUERIES = [
+    ("status_data: заголовок задачи",
+     "SELECT status, agent_name, start_time, pnl, total_fee, slider_value, period, number "
+     "FROM tasks WHERE id = %s"),
+    ("status_data: последние 20 сделок",
+     "SELECT log_time, symbol, side, amount, pnl_change FROM trade_logs "
+     "WHERE task_id = %s ORDER BY log_time DESC LIMIT 20"),
+    ("status_data: кумулятивный график",
+     "SELECT log_time, SUM(pnl_change) OVER (ORDER BY log_time, id ROWS BETWEEN UNBOUNDED PRECEDING "
+     "AND CURRENT ROW) AS pnl FROM trade_logs WHERE task_id = %s ORDER BY log_time, id"),
+    ("status_data: сделки после курсора since",
+     "SELECT log_time, symbol, side, amount, pnl_change FROM trade_logs "
+     "WHERE task_id = %s AND log_time > '1970-01-02' ORDER BY log_time ASC"),
+    ("status_data: график по минутным свёрткам",
+     "SELECT close_time, close_pnl FROM trade_rollups WHERE task_id = %s AND resolution = 60 "
+     "ORDER BY bucket_start"),
+    ("simulate_trading: загрузка агента",
+     "SELECT status, pnl, total_fee, start_time, slider_value, seed FROM tasks WHERE id = %s"),
+    ("write_buffer: обновление pnl",
+     "UPDATE tasks SET pnl = pnl + 0, total_fee = total_fee + 0 WHERE id = %s"),
+]
+
+
+def statements_for(statements, dialect):
+    if isinstance(statements, dict):
+        return statements[dialect]
+    return statements
+
+
+def current_version(cursor, dialect="mysql"):
+    engine = " ENGINE=InnoDB" if dialect == "mysql" else ""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            description VARCHAR(255),
+            applied_at DATETIME
+        ){engine}
+    """)
+    cursor.execute("SELECT MAX(version) AS version FROM schema_migrations")
+    row = cursor.fetchone()
+    return row["version"] or 0
+
+
+def _migrate(conn, cursor, dialect):
+    applied = []
+    version = current_version(cursor, dialect)
+    for number, description, statements in MIGRATIONS:
+        if number <= version:
+            continue
+        # DDL в MySQL коммитится неявно, поэтому фиксируем версию сразу после шага
+        for statement in statements_for(statements, dialect):
+            cursor.execute(statement)
+        cursor.execute(
+            "INSERT INTO schema_migrations (version, description, applied_at) VALUES (%s, %s, %s)",
+            (number, description, datetime.now())
+        )
+        conn.commit()
+        applied.append(number)
+    return applied
+
+
+def require_current(conn, dialect="mysql"):
+    """Без применения миграций: RuntimeError, если схема базы старее LATEST_VERSION."""
+    cursor = conn.cursor()
+    try:
+        version = current_version(cursor, dialect)
+        conn.commit()
+    finally:
+        cursor.close()
+    if version < LATEST_VERSION:
+        raise RuntimeError(f"Схема БД версии {version}, нужна {LATEST_VERSION}: выполните python migrations.py")
+    return version
+
+
+def apply_migrations(conn, dialect="mysql"):
+    """Применяет недостающие миграции. Возвращает список применённых версий."""
+    cursor = conn.cursor()
+    try:
+        if dialect != "mysql":
+            return _migrate(conn, cursor, dialect)
+        cursor.execute("SELECT GET_LOCK(%s, 60) AS locked", (LOCK_NAME,))
+        if not cursor.fetchone()["locked"]:
+            raise RuntimeError("Не удалось получить блокировку миграций")
+        try:
+            return _migrate(conn, cursor, dialect)
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def _mysql_plan_problems(description, rows):
+    problems = []
+    for row in rows:
+        extra = row.get("Extra") or ""
+        if "Impossible WHERE" in extra or "no matching row" in extra:
+            continue
+        if row.get("type") == "ALL" or row.get("key") is None:
+            problems.append(f"{description}: полный скан {row.get('table')}")
+        elif "Using filesort" in extra:
+            problems.append(f"{description}: сортировка без индекса (filesort)")
+    return problems
+
+
+def _sqlite_plan_problems(description, rows):
+    problems = []
+    for row in rows:
+        detail = row.get("detail") or ""
+        # "SCAN (subquery-N)" – проход по результату оконной функции, не по таблице
+        if detail.startswith("SCAN ") and "USING" not in detail and not detail.startswith("SCAN ("):
+            problems.append(f"{description}: полный скан ({detail})")
+        elif "TEMP B-TREE" in detail:
+            problems.append(f"{description}: сортировка без индекса ({detail})")
+    return problems
+
+
+def check_query_plans(conn, dialect="mysql", task_id=None):
+    """
+    Прогоняет EXPLAIN (EXPLAIN QUERY PLAN в SQLite) по HOT_QUERIES. Возвращает список
+    проблем (полный скан таблицы или сортировка без индекса); пустой список – всё в порядке.
+    """
+    problems = []
+    explain, plan_problems = (("EXPLAIN ", _mysql_plan_problems) if dialect == "mysql"
+                              else ("EXPLAIN QUERY PLAN ", _sqlite_plan_problems))
+    cursor = conn.cursor()
+    try:
+        if task_id is None:
+            cursor.execute("SELECT MAX(id) AS id FROM tasks")
+            task_id = cursor.fetchone()["id"] or 1
+        for description, query in HOT_QUERIES:
+            cursor.execute(explain + query, (task_id,))
+            problems.extend(plan_problems(description, cursor.fetchall()))
+    finally:
+        cursor.close()
+    return problems
+
+
+if __name__ == "__main__":
+    from storage import create_storage
+
+    storage = create_storage()
+    conn = storage.connection()
+    try:
+        print("Применены миграции:", apply_migrations(conn, storage.dialect) or "нет новых")
+        problems = check_query_plans(conn, storage.dialect)
+        for problem in problems:
+            print("ПЛАН:", problem)
+        if not problems:
+            print("Все горячие запросы обслуживаются индексами.")
+    finally:
+        conn.close()
+    raise SystemExit(1 if problems else 0)
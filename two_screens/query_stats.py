@@ -0,0 +1,124 @@
+"""
+Статистика SQL по нормализованному тексту запроса и лог медленных запросов.
+
+Подключается слушателем к storage.query_listeners: видит каждый execute/executemany
+синхронного и асинхронного хранилища. /query_stats показывает, какой из запросов
+status_data, simulate_trading (запись пачек) и chart_data тормозит по мере роста данных.
+"""
+import re
+import threading
+import time
+from collections import deque
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|\?")
+_VALUE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+")
+_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+OTHER_QUERY = "<other>"
+
+
+def normalize_query(query):
+    """Текст запроса без литералов и лишних пробелов: один ключ на все вызовы запроса."""
+    query = _STRING_LITERAL.sub("?", query)
+    query = _NUMBER_LITERAL.sub("?", query)
+    query = _PLACEHOLDER.sub("?", query)
+    query = _WHITESPACE.sub(" ", query).strip()
+    # Многострочные VALUES (...), (...) и IN-списки любой длины – как один набор
+    query = _IN_LIST.sub("IN (...)", query)
+    return _VALUE_LIST.sub("(...)", query)
+
+
+def _format_params(params, limit=5):
+    """Параметры для лога; у executemany – первые limit наборов и общее количество."""
+    if isinstance(params, (list, tuple)) and params and isinstance(params[0], (list, tuple)):
+        head = ", ".join(repr(tuple(p)) for p in params[:limit])
+        more = f" ... (+{len(params) - limit})" if len(params) > limit else ""
+        return f"[{head}{more}]"
+    return repr(params)
+
+
+class QueryStat:
+    __slots__ = ("calls", "total", "max", "rows")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+
+class QueryStats:
+    def __init__(self, slow_threshold=0.2, max_queries=500, slow_log_size=50):
+        """
+        slow_threshold  – порог медленного запроса, сек (лог с параметрами);
+        max_queries     – сколько разных текстов помнить, остальные – в OTHER_QUERY;
+        slow_log_size   – сколько последних медленных запросов отдавать в stats().
+        """
+        self.slow_threshold = slow_threshold
+        self.max_queries = max_queries
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._slow = deque(maxlen=slow_log_size)
+        self._normalized = {}  # сырой текст -> нормализованный (запросы повторяются)
+        self.since = time.time()
+
+    def on_query(self, query, params, duration, rows):
+        """Слушатель storage: fn(query, params, duration, rows)."""
+        key = self._normalized.get(query)
+        if key is None:
+            key = normalize_query(query)
+            if len(self._normalized) < self.max_queries * 4:
+                self._normalized[query] = key
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                if len(self._stats) >= self.max_queries:
+                    key = OTHER_QUERY
+                stat = self._stats.setdefault(key, QueryStat())
+            stat.calls += 1
+            stat.total += duration
+            if duration > stat.max:
+                stat.max = duration
+            if rows and rows > 0:
+                stat.rows += rows
+
+        if duration >= self.slow_threshold:
+            params_text = _format_params(params)
+            print(f"Медленный запрос ({duration * 1000:.1f} мс, строк: {rows}): {key} параметры: {params_text}")
+            with self._lock:
+                self._slow.append({
+                    "time": round(time.time(), 3),
+                    "duration_ms": round(duration * 1000, 3),
+                    "rows": rows,
+                    "query": key,
+                    "params": params_text,
+                })
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._slow.clear()
+            self.since = time.time()
+
+    def stats(self, limit=50):
+        """Запросы по убыванию суммарного времени и последние медленные запросы."""
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+            slow = list(self._slow)
+        return {
+            "since": round(self.since, 3),
+            "slow_threshold_ms": round(self.slow_threshold * 1000, 3),
+            "queries": [{
+                "query": key,
+                "calls": stat.calls,
+                "total_ms": round(stat.total * 1000, 3),
+                "mean_ms": round(stat.total * 1000 / stat.calls, 3),
+                "max_ms": round(stat.max * 1000, 3),
+                "rows": stat.rows,
+                "rows_per_call": round(stat.rows / stat.calls, 1),
+            } for key, stat in items],
+            "slow": slow,
+        }
@@ -0,0 +1,74 @@
+"""
+Свёртки кумулятивного PnL по минутам и часам (таблица trade_rollups).
+
+Запись: write_trades вызывает rollup_params() для каждой пачки сделок, зная
+tasks.pnl до пачки, и обновляет свёртки в той же транзакции (upsert).
+Чтение: график задачи, работающей дольше ROLLUP_MIN_RANGE, строится по точкам
+(close_time, close_pnl) свёрток – стоимость зависит от длины интервала, а не от числа сделок.
+"""
+from datetime import datetime, timedelta
+
+ROLLUP_RESOLUTIONS = (60, 3600)
+
+# Дольше ROLLUP_MIN_RANGE – минутные свёртки, дольше ROLLUP_HOUR_RANGE – часовые
+ROLLUP_MIN_RANGE = timedelta(minutes=5)
+ROLLUP_HOUR_RANGE = timedelta(days=2)
+
+# Максимум свечей в ответе /pnl_candles
+MAX_CANDLES = 2000
+
+
+def bucket_start(log_time, resolution):
+    """Начало интервала свёртки (resolution делит час: 60 или 3600 сек)."""
+    offset = (log_time.minute * 60 + log_time.second) % resolution
+    return log_time.replace(microsecond=0) - timedelta(seconds=offset)
+
+
+def series_resolution(start_time, now=None):
+    """Разрешение свёрток для графика задачи; None – читать сырые сделки."""
+    if start_time is None:
+        return None
+    span = (now or datetime.now()) - start_time
+    if span < ROLLUP_MIN_RANGE:
+        return None
+    return 60 if span < ROLLUP_HOUR_RANGE else 3600
+
+
+def rollup_params(rows, base_pnl, resolutions=ROLLUP_RESOLUTIONS):
+    """
+    Пачка сделок (task_id, log_time, symbol, side, amount, pnl_change) в порядке записи
+    и {task_id: tasks.pnl до пачки} -> параметры upsert'а trade_rollups:
+    (task_id, resolution, bucket_start, open, close, min, max, close_time, trades, volume).
+    open – кумулятивный PnL до первой сделки интервала, min/max/close – после сделок.
+    """
+    buckets = {}
+    cumulative = {task_id: float(pnl or 0) for task_id, pnl in base_pnl.items()}
+    for task_id, log_time, _symbol, _side, amount, pnl_change in rows:
+        before = cumulative.get(task_id, 0.0)
+        after = round(before + float(pnl_change), 2)
+        cumulative[task_id] = after
+        for resolution in resolutions:
+            key = (task_id, resolution, bucket_start(log_time, resolution))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = [before, after, after, after, log_time, 1, float(amount)]
+            else:
+                bucket[1] = after
+                bucket[2] = min(bucket[2], after)
+                bucket[3] = max(bucket[3], after)
+                bucket[4] = log_time
+                bucket[5] += 1
+                bucket[6] += float(amount)
+    return [(task_id, resolution, start, round(o, 2), c, lo, hi, close_time, trades, round(volume, 2))
+            for (task_id, resolution, start), (o, c, lo, hi, close_time, trades, volume) in buckets.items()]
+
+
+def candle_range(start, end, resolution=None):
+    """
+    Интервал и разрешение для /pnl_candles: минутные свёртки, пока их не больше
+    MAX_CANDLES, иначе часовые; слишком длинный интервал обрезается слева.
+    """
+    if resolution not in ROLLUP_RESOLUTIONS:
+        resolution = 60 if (end - start).total_seconds() / 60 <= MAX_CANDLES else 3600
+    earliest = end - timedelta(seconds=resolution * MAX_CANDLES)
+    return max(start, earliest), end, resolution
@@ -0,0 +1,139 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AgentScheduler:
+    """
+    Планировщик тиков для всех агентов сразу.
+
+    Вместо отдельного потока на агента держим кучу дедлайнов
+    (next_tick, seq, task_id) и один поток-диспетчер, который по наступлению
+    дедлайна отдаёт тик в небольшой пул воркеров. Количество потоков не зависит
+    от количества агентов: 1 диспетчер + workers.
+
+    tick(task_id) -> bool: True – агент продолжает работу, False – снять с расписания.
+    on_remove(task_id) вызывается, когда агент окончательно снят с расписания
+    (после последнего тика), – для очистки состояния агента.
+
+    stop(task_id) снимает агента сразу: запись в куче помечается устаревшей
+    (у каждого запуска свой токен), новых тиков не будет.
+    """
+
+    def __init__(self, tick, interval=5.0, workers=8, on_remove=None):
+        self._tick = tick
+        self._on_remove = on_remove
+        self.interval = interval
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._agents = {}      # task_id -> токен текущего запуска
+        self._inflight = set()  # task_id, чей тик сейчас выполняется
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="agent-tick")
+        self._thread = None
+        self._stopping = False
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="agent-scheduler", daemon=True)
+            self._thread.start()
+
+    def add(self, task_id, delay=None):
+        """Ставит агента в расписание; первый тик – через delay секунд (по умолчанию сразу)."""
+        with self._cond:
+            if task_id in self._agents:
+                return
+            token = object()
+            self._agents[task_id] = token
+            if task_id in self._inflight:
+                # Тик прошлого запуска ещё идёт – не пересекаемся с ним
+                delay = max(delay or 0.0, self.interval)
+            self._push(time.monotonic() + (delay or 0.0), task_id, token)
+
+    def stop(self, task_id):
+        """Снимает агента с расписания. False, если агент не был запущен."""
+        with self._cond:
+            if self._agents.pop(task_id, None) is None:
+                return False
+            inflight = task_id in self._inflight
+        if not inflight:
+            self._removed(task_id)
+        return True
+
+    def running(self):
+        """Количество агентов в расписании."""
+        with self._cond:
+            return len(self._agents)
+
+    def agents(self):
+        """task_id всех агентов в расписании."""
+        with self._cond:
+            return list(self._agents)
+
+    def is_running(self, task_id):
+        with self._cond:
+            return task_id in self._agents
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        self._executor.shutdown(wait=wait)
+
+    def _push(self, deadline, task_id, token):
+        heapq.heappush(self._heap, (deadline, next(self._seq), task_id, token))
+        self._cond.notify()
+
+    def _removed(self, task_id):
+        if self._on_remove is not None:
+            try:
+                self._on_remove(task_id)
+            except Exception as e:
+                print(f"Ошибка очистки агента {task_id}: {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    if self._heap:
+                        timeout = self._heap[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+                    self._cond.wait(timeout)
+                if self._stopping:
+                    return
+                now = time.monotonic()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    deadline, _, task_id, token = heapq.heappop(self._heap)
+                    if self._agents.get(task_id) is not token:
+                        continue  # агент остановлен – запись устарела
+                    self._inflight.add(task_id)
+                    due.append((deadline, task_id, token))
+            for deadline, task_id, token in due:
+                self._executor.submit(self._run_tick, task_id, token, deadline)
+
+    def _run_tick(self, task_id, token, deadline):
+        try:
+            keep = self._tick(task_id)
+        except Exception as e:
+            print(f"Ошибка тика агента {task_id}: {e}")
+            keep = True
+        with self._cond:
+            self._inflight.discard(task_id)
+            current = self._agents.get(task_id)
+            if current is token and keep and not self._stopping:
+                # Держим ритм относительно дедлайна, но не пытаемся "догонять" пропущенные тики
+                self._push(max(deadline + self.interval, time.monotonic()), task_id, token)
+                return
+            if current is token:
+                del self._agents[task_id]
+            removed = task_id not in self._agents
+        if removed:
+            self._removed(task_id)
@@ -0,0 +1,184 @@
+"""
+Генерация симулированных сделок агента.
+
+SimulatorEngine – чистый детерминированный генератор: ни времени, ни БД, ни ожиданий.
+Планировщик (app.py), задачи asyncio (asgi_app.py) и офлайн-бектест (backtest.py)
+только подставляют моменты сделок и пишут результат.
+
+Замер скорости генерации отдельно от приложения:  python simulator.py --trades 1000000
+"""
+import random
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - numpy необязателен
+    np = None
+
+TRADE_SYMBOLS = ["$DOGE", "$XRP", "$HAI", "$SOM", "$BTC", "$ETH"]
+TRADE_SIDES = ["buy", "sell"]
+TRADE_FEE = 0.05
+
+# Уровень риска со слайдера input.html (1 – Low, 2 – Mid, 3 – High): диапазоны amount и pnl_change
+Strategy = namedtuple("Strategy", "name amount_range pnl_range")
+STRATEGIES = {
+    1: Strategy("low", (10, 50), (-1.0, 1.5)),
+    2: Strategy("mid", (10, 100), (-2.0, 3.0)),
+    3: Strategy("high", (50, 200), (-5.0, 7.0)),
+}
+DEFAULT_RISK = 2
+
+# Сделки потока агента генерируются блоками со своим генератором (seed, номер блока)
+BLOCK_SIZE = 256
+VECTOR_BLOCK_SIZE = 8192
+
+
+def generate_agent_name():
+    """
+    Генерирует псевдослучайное имя агента, например 'Gosha#187654'.
+    """
+    possible_names = ["Gosha", "Slavik", "Nikolya", "Alexa", "Jenya", "Sergio", "Ivan", "Oleg", "Sasha"]
+    name = random.choice(possible_names)
+    number = random.randint(10000, 99999)
+    return f"{name}#{number}"
+
+
+def new_agent_seed():
+    """Seed потока сделок новой задачи (tasks.seed, BIGINT)."""
+    return random.getrandbits(62)
+
+
+def strategy_for(slider_value):
+    """Стратегия по уровню риска; значения вне 1..3 – ближайший уровень, мусор – средний."""
+    try:
+        level = round(float(slider_value))
+    except (TypeError, ValueError):
+        return STRATEGIES[DEFAULT_RISK]
+    return STRATEGIES[min(max(level, 1), len(STRATEGIES))]
+
+
+def trade_time():
+    return datetime.now().replace(microsecond=0)  # DATETIME в MySQL хранит секунды
+
+
+class SimulatorEngine:
+    """
+    Детерминированный поток сделок одного агента.
+
+    Сделка номер i зависит только от seed, стратегии и i: агент, возобновлённый
+    на другом узле с position = числу уже записанных сделок, продолжает тот же поток,
+    а сделки агента воспроизводятся (replay) с любого места. Поток режется на блоки,
+    у каждого свой генератор, поэтому переход к позиции стоит не больше одного блока.
+
+    vectorized=True – блоки генерирует numpy (массовая генерация в backtest.py);
+    такой поток другой, но так же воспроизводим. Без numpy – обычный режим.
+    """
+
+    def __init__(self, seed, strategy=STRATEGIES[DEFAULT_RISK], position=0, vectorized=False):
+        self.seed = seed
+        self.strategy = strategy
+        self.position = position
+        self.vectorized = vectorized and np is not None
+        self.block_size = VECTOR_BLOCK_SIZE if self.vectorized else BLOCK_SIZE
+        self._block_index = None
+        self._block = None
+
+    def step(self, log_times):
+        """
+        Следующие len(log_times) сделок потока, по одной на момент:
+        [(log_time, symbol, side, amount, pnl_change), ...].
+        """
+        count = len(log_times)
+        draws = []
+        while len(draws) < count:
+            index, offset = divmod(self.position, self.block_size)
+            taken = self._rows(index)[offset:offset + count - len(draws)]
+            draws.extend(taken)
+            self.position += len(taken)
+        return [(log_time,) + draw for log_time, draw in zip(log_times, draws)]
+
+    def _rows(self, index):
+        if index != self._block_index:
+            self._block = self._vector_block(index) if self.vectorized else self._python_block(index)
+            self._block_index = index
+        return self._block
+
+    def _python_block(self, index):
+        # Строковый seed хешируется SHA-512 – одинаково в любом процессе и на любом узле
+        rnd = random.Random(f"{self.seed}:{index}")
+        amount_lo, amount_hi = self.strategy.amount_range
+        pnl_lo, pnl_hi = self.strategy.pnl_range
+        return [(rnd.choice(TRADE_SYMBOLS), rnd.choice(TRADE_SIDES),
+                 round(rnd.uniform(amount_lo, amount_hi), 2), round(rnd.uniform(pnl_lo, pnl_hi), 2))
+                for _ in range(self.block_size)]
+
+    def _vector_block(self, index):
+        rng = np.random.default_rng([self.seed, index])
+        n = self.block_size
+        symbols = np.array(TRADE_SYMBOLS)[rng.integers(0, len(TRADE_SYMBOLS), n)].tolist()
+        sides = np.array(TRADE_SIDES)[rng.integers(0, len(TRADE_SIDES), n)].tolist()
+        amounts = np.round(rng.uniform(*self.strategy.amount_range, n), 2).tolist()
+        changes = np.round(rng.uniform(*self.strategy.pnl_range, n), 2).tolist()
+        return list(zip(symbols, sides, amounts, changes))
+
+
+def catch_up_times(last_time, now, interval, limit):
+    """
+    Время тиков, пропущенных агентом, который простоял с last_time до now (рестарт,
+    падение узла): не больше limit последних, чтобы возобновление не заливало базу сделками.
+    Тики отсчитываются от last_time (last_time + interval * k), поэтому все строго позже
+    last_time и не позже now; совпавшие с last_time после отбрасывания долей секунды пропускаем.
+    """
+    if last_time is None or limit <= 0:
+        return []
+    count = int((now - last_time).total_seconds() // interval)
+    times = (last_time + timedelta(seconds=interval * k) for k in range(max(1, count - limit + 1), count + 1))
+    return [t for t in (t.replace(microsecond=0) for t in times) if t > last_time]
+
+
+def agent_state(row, task_id):
+    """Состояние запущенного агента из строки storage.get_agent() / get_agents()."""
+    # pnl/fee в tasks отстают от буфера записи, поэтому текущие суммы держим в памяти
+    total_fee = round(float(row["total_fee"] or 0), 2)
+    # Задачи до появления tasks.seed получают поток по task_id; позиция – число записанных сделок
+    seed = row["seed"] if row["seed"] is not None else task_id
+    return {
+        "status": row["status"],
+        "start_time": row["start_time"],
+        "pnl": round(float(row["pnl"] or 0), 2),
+        "total_fee": total_fee,
+        "engine": SimulatorEngine(seed, strategy_for(row["slider_value"]), position=round(total_fee / TRADE_FEE)),
+    }
+
+
+def apply_trade(state, change_pnl):
+    state["pnl"] = round(state["pnl"] + change_pnl, 2)
+    state["total_fee"] = round(state["total_fee"] + TRADE_FEE, 2)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Скорость и воспроизводимость SimulatorEngine")
+    parser.add_argument("--trades", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=1, help="сделок на step()")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    now = trade_time()
+    for vectorized in ([False, True] if np is not None else [False]):
+        for risk, strategy in STRATEGIES.items():
+            engine = SimulatorEngine(args.seed, strategy, vectorized=vectorized)
+            times = [now] * args.batch
+            started = time.perf_counter()
+            trades = []
+            while len(trades) < args.trades:
+                trades.extend(engine.step(times))
+            elapsed = time.perf_counter() - started
+            replay = SimulatorEngine(args.seed, strategy, position=args.trades // 2, vectorized=vectorized)
+            same = replay.step([now] * 100) == trades[args.trades // 2:args.trades // 2 + 100]
+            pnl = sum(trade[4] for trade in trades)
+            print(f"{'numpy' if vectorized else 'python':<7}{strategy.name:<6}{len(trades) / elapsed:>12.0f} сделок/с"
+                  f"  PnL {pnl:>12.2f}  replay с середины: {'совпадает' if same else 'РАСХОДИТСЯ'}")
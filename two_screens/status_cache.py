@@ -0,0 +1,187 @@
+"""
+In-process кэш состояния задач для /status_data.
+
+На задачу храним заголовок (статус, PnL, fee, настройки), последние 20 строк лога
+и кумулятивный ряд PnL. Симулятор и stop_task обновляют кэш write-through,
+поэтому для горячих задач запросы вообще не доходят до MySQL.
+Write-through видит только сделки агентов своего процесса, поэтому кэшируются
+лишь задачи, чью аренду держит узел (см. leases.py); снятый с узла агент – discard().
+Задача попадает в кэш при первом промахе, в том числе при опросе по since
+(см. agent_node.AgentNode.read_status_snapshot).
+Память ограничена: LRU по количеству задач, TTL простоя и лимит точек ряда
+(слишком длинные ряды не кэшируются – такие задачи читаются из БД по курсору since).
+"""
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict, deque
+
+from etags import status_version
+
+LOG_LINES = 20
+STRIPES = 256
+
+
+def snapshot_view(header, logs, times, values, since=None):
+    """
+    Снимок задачи для /status_data: header, logs, chart_data, last_ts.
+    С since – только сделки новее since (мс). logs – [(t_ms, log)], новые первыми.
+    """
+    start = 0 if since is None else bisect_right(times, since)
+    chart_data = [[t, v] for t, v in zip(times[start:], values[start:])]
+    if chart_data:
+        last_ts = chart_data[-1][0]
+    else:
+        last_ts = since if since is not None else 0
+    return {
+        "header": dict(header),
+        "logs": [log for t, log in logs if since is None or t > since],
+        "chart_data": chart_data,
+        "last_ts": last_ts,
+    }
+
+
+class TaskStatus:
+    __slots__ = ("header", "logs", "times", "values", "touched")
+
+    def __init__(self, header, logs, times, values):
+        self.header = header
+        self.logs = deque(logs, maxlen=LOG_LINES)  # (t_ms, log), новые слева
+        self.times = times                          # t_ms по возрастанию
+        self.values = values                        # кумулятивный PnL
+        self.touched = time.monotonic()
+
+
+class StatusCache:
+    def __init__(self, max_tasks=1000, ttl=300, max_points=50000):
+        self.max_tasks = max_tasks
+        self.ttl = ttl
+        self.max_points = max_points
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Задачи с рядом длиннее max_points (ряд только растёт): целиком их больше не читаем
+        self._oversized = OrderedDict()
+        # Счётчики записей мимо кэша (по полосам task_id): загрузка из БД, во время
+        # которой по задаче прошла сделка, не кладётся в кэш – её снимок уже устарел
+        self._generations = [0] * STRIPES
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get(self, task_id):
+        entry = self._entries.get(task_id)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if now - entry.touched > self.ttl:
+            del self._entries[task_id]
+            self.evictions += 1
+            return None
+        entry.touched = now
+        self._entries.move_to_end(task_id)
+        return entry
+
+    def snapshot(self, task_id, since=None):
+        """
+        Копия состояния задачи: header, logs, chart_data, last_ts.
+        С since – только сделки новее since (мс). None, если задачи нет в кэше.
+        """
+        with self._lock:
+            entry = self._get(task_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return snapshot_view(entry.header, entry.logs, entry.times, entry.values, since)
+
+    def version(self, task_id):
+        """Дешёвая версия состояния задачи для ETag (без копирования ряда); None – нет в кэше."""
+        with self._lock:
+            entry = self._get(task_id)
+            if entry is None:
+                return None
+            header = entry.header
+            last_ts = entry.times[-1] if entry.times else None
+            return status_version(header["status"], header["pnl"], header["total_fee"], last_ts)
+
+    def begin_load(self, task_id):
+        """Токен для load(): вызывать до чтения из БД."""
+        with self._lock:
+            return self._generations[task_id % STRIPES]
+
+    def fits(self, task_id):
+        """Стоит ли читать задачу целиком ради кэша: False – её ряд уже не помещался."""
+        with self._lock:
+            return task_id not in self._oversized
+
+    def load(self, task_id, token, header, logs, times, values):
+        """Кладёт прочитанное из БД состояние (logs – [(t_ms, log)], новые первыми)."""
+        with self._lock:
+            if len(times) > self.max_points:
+                self._mark_oversized(task_id)
+                return False
+            if self._generations[task_id % STRIPES] != token:
+                return False
+            self._entries[task_id] = TaskStatus(header, logs, times, values)
+            self._entries.move_to_end(task_id)
+            while len(self._entries) > self.max_tasks:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def apply_trade(self, task_id, t_ms, log, pnl, total_fee):
+        """Write-through новой сделки; pnl после сделки – это и есть кумулятивный PnL."""
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                self._generations[task_id % STRIPES] += 1
+                return
+            entry.logs.appendleft((t_ms, log))
+            entry.times.append(t_ms)
+            entry.values.append(pnl)
+            entry.header["pnl"] = pnl
+            entry.header["total_fee"] = total_fee
+            entry.touched = time.monotonic()
+            if len(entry.times) > self.max_points:
+                del self._entries[task_id]
+                self.evictions += 1
+                self._mark_oversized(task_id)
+
+    def _mark_oversized(self, task_id):
+        self._oversized[task_id] = None
+        self._oversized.move_to_end(task_id)
+        while len(self._oversized) > self.max_tasks:
+            self._oversized.popitem(last=False)
+
+    def discard(self, task_id):
+        """Агент больше не тикает в этом процессе: его состояние дальше меняется мимо кэша."""
+        with self._lock:
+            self._entries.pop(task_id, None)
+            self._generations[task_id % STRIPES] += 1
+
+    def invalidate_loads(self, task_ids):
+        """
+        Сделки задач дошли до БД из буфера записи: загрузки, начатые раньше,
+        могли прочитать снимок без них – в кэш их не кладём.
+        """
+        with self._lock:
+            for task_id in task_ids:
+                self._generations[task_id % STRIPES] += 1
+
+    def set_status(self, task_id, status):
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is None:
+                self._generations[task_id % STRIPES] += 1
+                return
+            entry.header["status"] = status
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tasks": len(self._entries),
+                "points": sum(len(e.times) for e in self._entries.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,179 @@
+"""
+Форматирование данных страницы статуса.
+Общие функции для синхронного (app.py) и асинхронного (asgi_app.py) приложений,
+чтобы JSON-ответы у них совпадали байт в байт.
+"""
+from datetime import datetime
+
+from downsample import lttb
+
+# ?max_points в /status_data: LTTB оставляет не меньше 3 точек, без параметра и сверху – MAX_POINTS
+MIN_POINTS, MAX_POINTS = 3, 5000
+
+
+def to_ms(dt):
+    """datetime -> миллисекунды Unix (формат оси X в Highcharts)."""
+    return int(dt.timestamp() * 1000)
+
+
+def from_ms(t_ms):
+    return datetime.fromtimestamp(t_ms / 1000)
+
+
+def format_uptime(start_time):
+    """Время работы агента в виде ЧЧ:ММ:СС."""
+    if start_time is None:
+        return "N/A"
+    delta = datetime.now() - start_time
+    hours, remainder = divmod(int(delta.total_seconds()), 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def format_log(row):
+    return {
+        "log_time": row["log_time"].strftime("%Y-%m-%d %H:%M:%S"),
+        "symbol": row["symbol"],
+        "side": row["side"],
+        "amount": float(row["amount"]),
+        "pnl_change": float(row["pnl_change"])
+    }
+
+
+def task_header(task_row):
+    """Поля заголовка страницы статуса из строки tasks."""
+    # Преобразуем slider_value в текст риска
+    risk_map = {
+        1.0: "Low",
+        2.0: "Mid",
+        3.0: "High"
+    }
+    # slider_value мог быть Decimal или float; приводим к float для словаря
+    raw_slider = float(task_row["slider_value"]) if task_row["slider_value"] else 2.0
+    return {
+        "status": task_row["status"],
+        "agent_name": task_row["agent_name"],
+        "start_time": task_row["start_time"],
+        "pnl": round(float(task_row["pnl"]), 2) if task_row["pnl"] else 0.0,
+        "total_fee": round(float(task_row["total_fee"]), 2) if task_row["total_fee"] else 0.0,
+        "risk_text": risk_map.get(raw_slider, "Unknown"),
+        "period": task_row["period"] or "N/A",
+        "operated_amount": float(task_row["number"]) if task_row["number"] else 0.0,
+    }
+
+
+def build_snapshot(data, since=None):
+    """
+    Результат storage.load_status() -> (snapshot, cache_entry).
+    cache_entry – (header, logs, times, values) для status_cache.load()
+    при полном чтении, None при чтении по курсору.
+    """
+    task_row = data["task"]
+    header = task_header(task_row)
+
+    if since is None:
+        # Логи (последние 20) и данные для графика: кумулятивный PnL уже посчитан в SQL
+        logs = [(to_ms(row["log_time"]), format_log(row)) for row in data["recent"]]
+        times = [to_ms(log_time) for log_time, _ in data["trades"]]
+        values = [pnl for _, pnl in data["trades"]]
+
+        snapshot = {
+            "header": header,
+            "logs": [log for _, log in logs],
+            "chart_data": [[t, v] for t, v in zip(times, values)],
+            "last_ts": times[-1] if times else 0,
+        }
+        return snapshot, (dict(header), logs, times, values)
+
+    # Только сделки после курсора.
+    # Кумулятивный PnL после последней сделки равен tasks.pnl (снимок согласован),
+    # поэтому стартовую точку восстанавливаем без чтения всей истории.
+    new_trades = data["trades"]
+    cumulative = (task_row["pnl"] or 0) - sum(tr["pnl_change"] for tr in new_trades)
+    chart_data = []
+    for tr in new_trades:
+        cumulative += tr["pnl_change"]
+        chart_data.append([to_ms(tr["log_time"]), round(float(cumulative), 2)])
+    snapshot = {
+        "header": header,
+        "logs": [format_log(row) for row in reversed(new_trades[-20:])],
+        "chart_data": chart_data,
+        "last_ts": chart_data[-1][0] if chart_data else since,
+    }
+    return snapshot, None
+
+
+def merge_pending(data, rows):
+    """
+    Полный снимок storage.load_status() + сделки задачи из буфера записи
+    (trade_writer.pending_rows()): в БД их ещё нет, а tasks.pnl/total_fee отстают на их сумму.
+    """
+    if not rows:
+        return data
+    task = dict(data["task"])
+    task["pnl"] = float(task["pnl"] or 0) + sum(row[4] for row in rows)
+    task["total_fee"] = float(task["total_fee"] or 0) + sum(row[5] for row in rows)
+    trades = list(data["trades"])
+    cumulative = float(trades[-1][1]) if trades else 0.0
+    for log_time, _, _, _, pnl_change, _ in rows:
+        cumulative += pnl_change
+        trades.append((log_time, round(cumulative, 2)))
+    recent = [
+        {"log_time": log_time, "symbol": symbol, "side": side, "amount": amount, "pnl_change": pnl_change}
+        for log_time, symbol, side, amount, pnl_change, _ in reversed(rows)
+    ]
+    return {"task": task, "recent": (recent + list(data["recent"]))[:20], "trades": trades}
+
+
+def parse_max_points(value):
+    """?max_points -> сколько точек оставить в chart_data; ValueError, если меньше MIN_POINTS."""
+    if value is None:
+        return MAX_POINTS
+    if value < MIN_POINTS:
+        raise ValueError(f"max_points: не меньше {MIN_POINTS}")
+    return min(value, MAX_POINTS)
+
+
+def status_payload(snapshot, since=None, max_points=None):
+    """JSON-ответ /status_data/<task_id>."""
+    header = snapshot["header"]
+    # Прореживаем после вычисления last_ts: курсор всегда указывает на последнюю сделку
+    chart_data = lttb(snapshot["chart_data"], max_points)
+    return {
+        "status": header["status"],
+        "agent_name": header["agent_name"],
+        "uptime": format_uptime(header["start_time"]),
+        "pnl": header["pnl"],
+        "total_fee": header["total_fee"],
+        "logs": snapshot["logs"],
+        "chart_data": chart_data,
+        "incremental": since is not None,
+        "last_ts": snapshot["last_ts"],
+        # Новые ключи для отображения на фронтенде
+        "risk_text": header["risk_text"],
+        "period": header["period"],
+        "operated_amount": header["operated_amount"]
+    }
+
+
+def candles_payload(rows, resolution):
+    """JSON /pnl_candles: [[t_ms, open, high, low, close, trades, volume], ...] (формат OHLC Highcharts)."""
+    return {
+        "resolution": resolution,
+        "candles": [[to_ms(bucket_start), *values] for bucket_start, *values in rows],
+    }
+
+
+def trade_event(state, t_ms, log):
+    """SSE-событие trade: дельта после одной сделки агента."""
+    return {
+        "type": "trade",
+        "incremental": True,
+        "status": state["status"],
+        "uptime": format_uptime(state["start_time"]),
+        "pnl": state["pnl"],
+        "total_fee": state["total_fee"],
+        "logs": [log],
+        "chart_data": [[t_ms, state["pnl"]]],
+        "last_ts": t_ms,
+    }
@@ -0,0 +1,792 @@
+"""
+Хранилище two_screens: задачи, лог сделок и выборки для графиков.
+
+SQLStorage описывает интерфейс и выполняет операции Operations – общий SQL
+(плейсхолдеры %s, строки – dict), его же выполняет async_storage.AsyncMySQLStorage.
+Реализации отличаются только тем, откуда берутся соединения:
+  MySQLStorage  – пул соединений PyMySQL к боевой базе;
+  SQLiteStorage – локальный файл или :memory: (тесты, нагрузочные прогоны без сети).
+Соединение, полученное через connection(), возвращается/освобождается вызовом close().
+"""
+import functools
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal
+
+import pymysql
+
+from chart_data import histogram_counts, histogram_width, series_step, where_sql, window_conditions
+from db_pool import ConnectionPool
+from etags import status_version
+from export import EXPORT_CHUNK_ROWS, TRADES_EXPORT_QUERY, export_conditions
+from migrations import apply_migrations, check_query_plans, require_current, rollup_backfill
+from rollups import rollup_params, series_resolution
+
+STOPPED_STATUS = "зупинено"
+RUNNING_STATUS = "в обробці"
+QUEUED_STATUS = "в черзі"  # запуск ждёт места (admission.py)
+
+# Конфигурация подключения к MySQL
+DATABASE_CONFIG = {
+    'host': 'ub469996.mysql.tools',
+    'user': 'ub469996_twoscreens',
+    'password': '&;NeLfg295',
+    'database': 'ub469996_twoscreens',
+    'charset': 'utf8mb4',
+    'cursorclass': pymysql.cursors.DictCursor
+}
+
+# conn.cursor(TUPLE_CURSOR) – строки-кортежи вместо dict (поддерживают все бэкенды)
+TUPLE_CURSOR = pymysql.cursors.Cursor
+
+# SQL общий для синхронных (storage.py) и асинхронных (async_storage.py) реализаций
+CREATE_TASK_QUERY = """
+    INSERT INTO tasks (number, slider_value, period, status, agent_name, start_time, seed)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+AGENT_QUERY = "SELECT status, pnl, total_fee, start_time, slider_value, seed FROM tasks WHERE id=%s"
+# Пачка агентов при возобновлении после рестарта: состояние и время последней сделки.
+# log_time берётся из строки (а не MAX), чтобы SQLite вернул DATETIME, а не текст
+AGENTS_QUERY = """
+    SELECT t.id, t.status, t.pnl, t.total_fee, t.start_time, t.slider_value, t.seed, l.log_time AS last_time
+    FROM tasks t
+    LEFT JOIN trade_logs l ON l.id = (
+        SELECT id FROM trade_logs WHERE task_id = t.id ORDER BY log_time DESC, id DESC LIMIT 1
+    )
+    WHERE t.id IN ({placeholders})
+"""
+SET_STATUS_QUERY = "UPDATE tasks SET status = %s WHERE id = %s"
+FINISH_TASK_QUERY = "UPDATE tasks SET status=%s WHERE id=%s AND (status IS NULL OR status <> %s)"
+# Запуск из очереди: только если задачу не остановили, пока она ждала
+START_QUEUED_QUERY = "UPDATE tasks SET status=%s WHERE id=%s AND status=%s"
+# Место в общей очереди всех узлов (по id задачи) и её длина; queued = 0 – задача не ждёт
+QUEUE_POSITION_QUERY = """
+    SELECT COUNT(*) AS pending,
+           SUM(CASE WHEN id <= %s THEN 1 ELSE 0 END) AS position,
+           SUM(CASE WHEN id = %s THEN 1 ELSE 0 END) AS queued
+    FROM tasks
+    WHERE status = %s
+"""
+# /chart_data (см. chart_data.py): {where} – окно по start_time, агрегирование в базе
+TASK_ID_RANGE_QUERY = "SELECT MIN(id), MAX(id) FROM tasks{where}"
+TASK_PNL_SERIES_QUERY = {
+    "mysql": """
+        SELECT (id - %s) DIV %s AS bucket, ROUND(AVG(COALESCE(pnl, 0)), 2)
+        FROM tasks{where}
+        GROUP BY bucket
+        ORDER BY bucket
+    """,
+    "sqlite": """
+        SELECT (id - %s) / %s AS bucket, ROUND(AVG(COALESCE(pnl, 0)), 2)
+        FROM tasks{where}
+        GROUP BY bucket
+        ORDER BY bucket
+    """,
+}
+TASK_PNL_RANGE_QUERY = "SELECT MIN(COALESCE(pnl, 0)), MAX(COALESCE(pnl, 0)), COUNT(*) FROM tasks{where}"
+TASK_PNL_HISTOGRAM_QUERY = {
+    "mysql": "SELECT FLOOR((COALESCE(pnl, 0) - %s) / %s) AS bucket, COUNT(*) FROM tasks{where} GROUP BY bucket",
+    "sqlite": "SELECT CAST((COALESCE(pnl, 0) - %s) / %s AS INTEGER) AS bucket, COUNT(*) FROM tasks{where} GROUP BY bucket",
+}
+TASK_PNL_PAGE_QUERY = "SELECT id, COALESCE(pnl, 0), start_time FROM tasks{where} ORDER BY id LIMIT %s"
+TASK_HEADER_QUERY = """
+    SELECT status, agent_name, start_time, pnl, total_fee,
+           slider_value, period, number
+    FROM tasks
+    WHERE id = %s
+"""
+# Версия задачи для ETag /status_data: строка по первичному ключу и MAX по индексу
+# (task_id, log_time); total_fee растёт с каждой сделкой
+TASK_VERSION_QUERY = """
+    SELECT status, pnl, total_fee,
+           (SELECT MAX(log_time) FROM trade_logs WHERE task_id = %s) AS last_time
+    FROM tasks
+    WHERE id = %s
+"""
+RECENT_TRADES_QUERY = """
+    SELECT log_time, symbol, side, amount, pnl_change
+    FROM trade_logs
+    WHERE task_id = %s
+    ORDER BY log_time DESC
+    LIMIT 20
+"""
+# Кумулятивный PnL считает база (оконная функция, MySQL 8.0.17+ / SQLite 3.25+):
+# строки (log_time, pnl) читаются курсором-кортежем TUPLE_CURSOR, без Decimal и dict на строку.
+# id в ORDER BY и ROWS-рамка – сделки одной секунды получают разные суммы
+TRADE_SERIES_QUERY = """
+    SELECT log_time,
+           CAST(ROUND(SUM(pnl_change) OVER (
+               ORDER BY log_time, id ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW
+           ), 2) AS DOUBLE) AS pnl
+    FROM trade_logs
+    WHERE task_id = %s
+    ORDER BY log_time, id
+"""
+TRADES_SINCE_QUERY = """
+    SELECT log_time, symbol, side, amount, pnl_change
+    FROM trade_logs
+    WHERE task_id = %s AND log_time > %s
+    ORDER BY log_time ASC
+"""
+# executemany в PyMySQL/aiomysql склеивает INSERT ... VALUES в многострочные вставки
+INSERT_TRADES_QUERY = """
+    INSERT INTO trade_logs (task_id, log_time, symbol, side, amount, pnl_change)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+UPDATE_TASK_TOTALS_QUERY = """
+    UPDATE tasks
+    SET pnl = pnl + %s,
+        total_fee = total_fee + %s
+    WHERE id = %s
+"""
+# tasks.pnl до пачки – база кумулятивного PnL для свёрток (IN-список строит task_pnl_query)
+TASK_PNL_QUERY = "SELECT id, pnl FROM tasks WHERE id IN ({placeholders})"
+# open_pnl не обновляется: это значение до первой сделки интервала
+UPSERT_ROLLUP_QUERY = {
+    "mysql": """
+        INSERT INTO trade_rollups (task_id, resolution, bucket_start, open_pnl, close_pnl,
+                                   min_pnl, max_pnl, close_time, trades, volume)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            close_pnl = VALUES(close_pnl),
+            min_pnl = LEAST(min_pnl, VALUES(min_pnl)),
+            max_pnl = GREATEST(max_pnl, VALUES(max_pnl)),
+            close_time = VALUES(close_time),
+            trades = trades + VALUES(trades),
+            volume = volume + VALUES(volume)
+    """,
+    "sqlite": """
+        INSERT INTO trade_rollups (task_id, resolution, bucket_start, open_pnl, close_pnl,
+                                   min_pnl, max_pnl, close_time, trades, volume)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (task_id, resolution, bucket_start) DO UPDATE SET
+            close_pnl = excluded.close_pnl,
+            min_pnl = MIN(min_pnl, excluded.min_pnl),
+            max_pnl = MAX(max_pnl, excluded.max_pnl),
+            close_time = excluded.close_time,
+            trades = trades + excluded.trades,
+            volume = volume + excluded.volume
+    """,
+}
+# График длинной задачи: последняя сделка каждого интервала (реальная точка ряда,
+# поэтому курсор since остаётся корректным)
+ROLLUP_SERIES_QUERY = """
+    SELECT close_time, CAST(close_pnl AS DOUBLE) AS pnl
+    FROM trade_rollups
+    WHERE task_id = %s AND resolution = %s
+    ORDER BY bucket_start
+"""
+ROLLUP_CANDLES_QUERY = """
+    SELECT bucket_start, CAST(open_pnl AS DOUBLE), CAST(max_pnl AS DOUBLE),
+           CAST(min_pnl AS DOUBLE), CAST(close_pnl AS DOUBLE), trades, CAST(volume AS DOUBLE)
+    FROM trade_rollups
+    WHERE task_id = %s AND resolution = %s AND bucket_start >= %s AND bucket_start < %s
+    ORDER BY bucket_start
+"""
+# Аренды агентов (см. leases.py). Время – по часам базы: узлы с расходящимися часами
+# одинаково понимают, истекла ли аренда. {expiry} – сейчас + ttl (параметр, секунды)
+LEASE_NOW = {"mysql": "NOW()", "sqlite": "datetime('now')"}
+LEASE_EXPIRY = {"mysql": "NOW() + INTERVAL %s SECOND", "sqlite": "datetime('now', '+' || %s || ' seconds')"}
+ACQUIRE_LEASE_QUERY = "INSERT INTO agent_leases (task_id, node_id, expires_at) VALUES (%s, %s, {expiry})"
+EXPIRED_LEASES_QUERY = "SELECT task_id FROM agent_leases WHERE expires_at < {now} ORDER BY expires_at LIMIT %s"
+# Условие expires_at < now проверяется ещё раз в UPDATE: из двух узлов аренду получает один
+CLAIM_LEASES_QUERY = """
+    UPDATE agent_leases
+    SET node_id = %s, expires_at = {expiry}
+    WHERE task_id IN ({placeholders}) AND expires_at < {now}
+"""
+RENEW_LEASES_QUERY = "UPDATE agent_leases SET expires_at = {expiry} WHERE node_id = %s"
+HELD_LEASES_QUERY = "SELECT task_id FROM agent_leases WHERE node_id = %s"
+RELEASE_LEASE_QUERY = "DELETE FROM agent_leases WHERE task_id = %s"
+# При штатной остановке узла аренды сразу становятся просроченными – их забирают другие узлы
+EXPIRE_LEASES_QUERY = "UPDATE agent_leases SET expires_at = %s WHERE node_id = %s"
+LEASE_EPOCH = datetime(1970, 1, 1)
+
+
+def task_pnl_query(task_ids):
+    return TASK_PNL_QUERY.format(placeholders=", ".join(["%s"] * len(task_ids)))
+
+
+def queue_position(row):
+    return {"position": int(row["position"]) if row["queued"] else None, "pending": int(row["pending"])}
+
+
+def agents_query(task_ids):
+    return AGENTS_QUERY.format(placeholders=", ".join(["%s"] * len(task_ids)))
+
+
+def lease_query(query, dialect, task_ids=()):
+    """Подставляет в SQL аренд время базы для dialect и IN-список на task_ids."""
+    return query.format(now=LEASE_NOW[dialect], expiry=LEASE_EXPIRY[dialect],
+                        placeholders=", ".join(["%s"] * len(task_ids)))
+
+
+def task_totals_params(totals):
+    """{task_id: (pnl, fee)} -> параметры UPDATE_TASK_TOTALS_QUERY."""
+    return [(round(pnl_sum, 2), round(fee_sum, 2), task_id)
+            for task_id, (pnl_sum, fee_sum) in totals.items()]
+
+
+# Операции хранилища без ввода-вывода (как SimulatorEngine у симулятора): генераторы шагов
+# Query и COMMIT, результат – значение return. Один и тот же SQL в одном порядке выполняют
+# SQLStorage.run() (PyMySQL, SQLite) и async_storage.AsyncMySQLStorage.run() (aiomysql).
+# Query.fetch – что генератор получит обратно: "one", "all", "rowcount", "lastrowid" или None;
+# tuples – строки-кортежи (TUPLE_CURSOR) вместо dict; many – executemany.
+Query = namedtuple("Query", "sql params fetch tuples many", defaults=(None, False, False))
+COMMIT = object()
+
+
+class Operations:
+    """Операции хранилища; self – любое хранилище с атрибутом dialect (вызываются через run())."""
+
+    # --- tasks ---
+
+    def create_task(self, number, slider_value, period, status, agent_name, start_time, seed=None,
+                    node_id=None, ttl=None, on_created=None):
+        """
+        Новая задача; с node_id – сразу с арендой узла на ttl секунд, в той же транзакции
+        (задачи без аренды, которую никто не запустит, не бывает). on_created(task_id) – до COMMIT.
+        """
+        task_id = yield Query(CREATE_TASK_QUERY, (number, slider_value, period, status, agent_name, start_time, seed),
+                              "lastrowid")
+        if node_id is not None:
+            yield Query(lease_query(ACQUIRE_LEASE_QUERY, self.dialect), (task_id, node_id, ttl))
+        if on_created is not None:
+            on_created(task_id)
+        yield COMMIT
+        return task_id
+
+    def get_agent(self, task_id):
+        """Состояние, нужное симулятору: status, pnl, total_fee, start_time, slider_value, seed (или None)."""
+        return (yield Query(AGENT_QUERY, (task_id,), "one"))
+
+    def get_agents(self, task_ids):
+        """get_agent() для пачки задач одним запросом: {task_id: строка + last_time}."""
+        rows = yield Query(agents_query(task_ids), list(task_ids), "all")
+        return {row["id"]: row for row in rows}
+
+    def set_status(self, task_id, status):
+        yield Query(SET_STATUS_QUERY, (status, task_id))
+        yield COMMIT
+
+    def finish_task(self, task_id, finish_text):
+        """Ставит итоговый статус, если задача не была остановлена вручную. True – обновили."""
+        updated = yield Query(FINISH_TASK_QUERY, (finish_text, task_id, STOPPED_STATUS), "rowcount")
+        yield COMMIT
+        return updated > 0
+
+    def start_queued(self, task_id):
+        """«в черзі» -> «в обробці». False – задачу уже остановили (или её нет)."""
+        updated = yield Query(START_QUEUED_QUERY, (RUNNING_STATUS, task_id, QUEUED_STATUS), "rowcount")
+        yield COMMIT
+        return updated > 0
+
+    def queue_position(self, task_id):
+        """{"position": место с 1 или None, если задача не ждёт, "pending": длина очереди}."""
+        return queue_position((yield Query(QUEUE_POSITION_QUERY, (task_id, task_id, QUEUED_STATUS), "one")))
+
+    def chart_data(self, query):
+        """
+        PnL задач для /chart_data (query – chart_data.ChartQuery), агрегирование в базе:
+          series    – [средний pnl группы задач, ...] не длиннее query.size;
+          histogram – (нижняя граница, ширина корзины, [количество, ...], всего задач);
+          page      – [(id, pnl, start_time), ...] после query.after_id.
+        """
+        conditions, params = window_conditions(query)
+        if query.mode == "series":
+            lo_id, hi_id = yield Query(TASK_ID_RANGE_QUERY.format(where=where_sql(conditions)), params, "one", True)
+            if lo_id is None:
+                return []
+            rows = yield Query(TASK_PNL_SERIES_QUERY[self.dialect].format(where=where_sql(conditions)),
+                               [lo_id, series_step(lo_id, hi_id, query.size)] + params, "all", True)
+            # round: в SQLite DECIMAL хранится как REAL и копит погрешность
+            return [round(float(pnl), 2) for _, pnl in rows]
+        if query.mode == "histogram":
+            lo, hi, total = yield Query(TASK_PNL_RANGE_QUERY.format(where=where_sql(conditions)), params, "one", True)
+            if not total:
+                return 0.0, 1.0, [], 0
+            lo, hi = float(lo), float(hi)
+            width = histogram_width(lo, hi, query.size)
+            rows = yield Query(TASK_PNL_HISTOGRAM_QUERY[self.dialect].format(where=where_sql(conditions)),
+                               [lo, width] + params, "all", True)
+            return lo, width, histogram_counts(rows, query.size), total
+        rows = yield Query(TASK_PNL_PAGE_QUERY.format(where=where_sql(["id > %s"] + conditions)),
+                           [query.after_id] + params + [query.size], "all", True)
+        return [(row_id, round(float(pnl), 2), start_time) for row_id, pnl, start_time in rows]
+
+    def task_version(self, task_id):
+        """Версия состояния задачи для ETag (etags.status_version) или None, если задачи нет."""
+        row = yield Query(TASK_VERSION_QUERY, (task_id, task_id), "one", True)
+        return None if row is None else status_version(*row)
+
+    # --- trade_logs ---
+
+    def load_status(self, task_id, since=None):
+        """
+        Всё для страницы статуса одним снимком (одна транзакция):
+          task   – строка tasks;
+          recent – последние 20 сделок, новые первыми (только без since);
+          trades – без since: кортежи (log_time, кумулятивный pnl) по времени – все сделки,
+                   а у задач дольше rollups.ROLLUP_MIN_RANGE последняя сделка каждого
+                   интервала свёртки; с since (datetime): полные строки сделок новее since.
+        None, если задачи нет.
+        """
+        task_row = yield Query(TASK_HEADER_QUERY, (task_id,), "one")
+        if not task_row:
+            return None
+        if since is not None:
+            trades = yield Query(TRADES_SINCE_QUERY, (task_id, since), "all")
+            return {"task": task_row, "recent": None, "trades": trades}
+        recent = yield Query(RECENT_TRADES_QUERY, (task_id,), "all")
+        resolution = series_resolution(task_row["start_time"])
+        if resolution is None:
+            trades = yield Query(TRADE_SERIES_QUERY, (task_id,), "all", True)
+        else:
+            trades = yield Query(ROLLUP_SERIES_QUERY, (task_id, resolution), "all", True)
+        return {"task": task_row, "recent": recent, "trades": trades}
+
+    def write_trades(self, rows, totals):
+        """
+        Пачка сделок одной транзакцией:
+          rows   – (task_id, log_time, symbol, side, amount, pnl_change);
+          totals – {task_id: (сумма pnl_change, сумма комиссий)}.
+        Заодно обновляет минутные и часовые свёртки trade_rollups.
+        """
+        # Сделки одной задачи пишет один поток записи, поэтому tasks.pnl
+        # до пачки не меняется до UPDATE ниже
+        task_ids = sorted(totals)
+        base_rows = yield Query(task_pnl_query(task_ids), task_ids, "all")
+        base_pnl = {row["id"]: row["pnl"] for row in base_rows}
+        yield Query(INSERT_TRADES_QUERY, rows, many=True)
+        yield Query(UPDATE_TASK_TOTALS_QUERY, task_totals_params(totals), many=True)
+        yield Query(UPSERT_ROLLUP_QUERY[self.dialect], rollup_params(rows, base_pnl), many=True)
+        yield COMMIT
+
+    def load_trades(self, rows, totals):
+        """
+        Массовая загрузка (backtest.py): как write_trades(), но без свёрток –
+        их пересобирает rebuild_rollups() после загрузки, одним INSERT ... SELECT.
+        """
+        yield Query(INSERT_TRADES_QUERY, rows, many=True)
+        yield Query(UPDATE_TASK_TOTALS_QUERY, task_totals_params(totals), many=True)
+        yield COMMIT
+
+    def rebuild_rollups(self, task_ids):
+        """Свёртки задач заново из trade_logs (после load_trades)."""
+        # В SQL свёрток есть % форматов дат, поэтому id (целые) подставляются в текст, а не параметрами
+        where = " WHERE task_id IN ({})".format(", ".join(str(int(task_id)) for task_id in task_ids))
+        yield Query("DELETE FROM trade_rollups" + where, None)
+        for statement in rollup_backfill(self.dialect, where):
+            yield Query(statement, None)
+        yield COMMIT
+
+    def rollup_candles(self, task_id, resolution, start, end):
+        """Свёртки [start, end): кортежи (bucket_start, open, high, low, close, trades, volume)."""
+        return (yield Query(ROLLUP_CANDLES_QUERY, (task_id, resolution, start, end), "all", True))
+
+    # --- agent_leases ---
+
+    def claim_leases(self, node_id, ttl, limit):
+        """Забирает до limit просроченных аренд; возвращает task_id, доставшиеся node_id."""
+        rows = yield Query(lease_query(EXPIRED_LEASES_QUERY, self.dialect), (limit,), "all", True)
+        task_ids = [row[0] for row in rows]
+        if not task_ids:
+            yield COMMIT
+            return []
+        yield Query(lease_query(CLAIM_LEASES_QUERY, self.dialect, task_ids), [node_id, ttl] + task_ids)
+        yield COMMIT
+        # Новая транзакция – свежий снимок: видны аренды, перехваченные другими узлами
+        rows = yield Query(HELD_LEASES_QUERY, (node_id,), "all", True)
+        held = {row[0] for row in rows}
+        yield COMMIT
+        return [task_id for task_id in task_ids if task_id in held]
+
+    def renew_leases(self, node_id, ttl):
+        """Продлевает все аренды node_id; возвращает task_id аренд, которые у него остались."""
+        yield Query(lease_query(RENEW_LEASES_QUERY, self.dialect), (ttl, node_id))
+        yield COMMIT
+        rows = yield Query(HELD_LEASES_QUERY, (node_id,), "all", True)
+        held = [row[0] for row in rows]
+        yield COMMIT
+        return held
+
+    def release_lease(self, task_id):
+        """Задача остановлена или завершена – аренда больше никому не нужна."""
+        yield Query(RELEASE_LEASE_QUERY, (task_id,))
+        yield COMMIT
+
+    def expire_leases(self, node_id):
+        yield Query(EXPIRE_LEASES_QUERY, (LEASE_EPOCH, node_id))
+        yield COMMIT
+
+
+def operation(op):
+    """Метод синхронного хранилища из генератора Operations: выполняет его через self.run()."""
+    @functools.wraps(op)
+    def method(self, *args, **kwargs):
+        return self.run(op(self, *args, **kwargs))
+    return method
+
+
+# Слушатели SQL: fn(query, params, duration, rows) после каждого execute/executemany
+# (метрики /metrics); вызываются в потоке, выполнившем запрос
+query_listeners = []
+
+
+def notify_query(query, params, duration, rows):
+    for listener in query_listeners:
+        try:
+            listener(query, params, duration, rows)
+        except Exception as e:
+            print(f"Ошибка слушателя SQL: {e}")
+
+
+class _TimedCursor:
+    """Курсор, сообщающий query_listeners о каждом запросе и его длительности."""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        result = self._raw.execute(query, params)
+        notify_query(query, params, time.perf_counter() - started, self._raw.rowcount)
+        return result
+
+    def executemany(self, query, seq_of_params):
+        started = time.perf_counter()
+        result = self._raw.executemany(query, seq_of_params)
+        notify_query(query, seq_of_params, time.perf_counter() - started, self._raw.rowcount)
+        return result
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class _TimedConnection:
+    def __init__(self, raw):
+        self._raw = raw
+
+    def cursor(self, *args):
+        return _TimedCursor(self._raw.cursor(*args))
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+
+class StorageUnavailable(Exception):
+    """Не удалось получить соединение с хранилищем."""
+
+
+class SQLStorage:
+    dialect = None
+
+    def connection(self):
+        """Соединение с интерфейсом PyMySQL (cursor/commit/rollback/close)."""
+        return _TimedConnection(self._connect())
+
+    def _connect(self):
+        """Соединение конкретного бэкенда; реализуют наследники."""
+        raise NotImplementedError
+
+    def init_schema(self, migrate=True):
+        """
+        Применяет миграции (migrate=False – только проверяет, что схема актуальна)
+        и проверяет планы горячих запросов; возвращает список проблем.
+        Ошибка миграции или устаревшая схема – исключение: на такой схеме работать нельзя.
+        """
+        conn = self.connection()
+        try:
+            if migrate:
+                applied = apply_migrations(conn, self.dialect)
+                if applied:
+                    print("Применены миграции:", applied)
+            else:
+                require_current(conn, self.dialect)
+            return check_query_plans(conn, self.dialect)
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {}
+
+    def close(self):
+        pass
+
+    def run(self, operation):
+        """Выполняет операцию (генератор Operations) на одном соединении."""
+        conn = self.connection()
+        cursors = {}
+        try:
+            result = None
+            while True:
+                try:
+                    step = operation.send(result)
+                except StopIteration as stop:
+                    return stop.value
+                if step is COMMIT:
+                    conn.commit()
+                    result = None
+                    continue
+                cursor = cursors.get(step.tuples)
+                if cursor is None:
+                    cursor = cursors[step.tuples] = conn.cursor(TUPLE_CURSOR) if step.tuples else conn.cursor()
+                if step.many:
+                    cursor.executemany(step.sql, step.params)
+                else:
+                    cursor.execute(step.sql, step.params)
+                if step.fetch == "one":
+                    result = cursor.fetchone()
+                elif step.fetch == "all":
+                    result = cursor.fetchall()
+                else:
+                    result = getattr(cursor, step.fetch) if step.fetch else None
+        finally:
+            for cursor in cursors.values():
+                cursor.close()
+            conn.close()
+
+    # --- tasks ---
+
+    create_task = operation(Operations.create_task)
+    get_agent = operation(Operations.get_agent)
+    get_agents = operation(Operations.get_agents)
+    set_status = operation(Operations.set_status)
+    finish_task = operation(Operations.finish_task)
+    start_queued = operation(Operations.start_queued)
+    queue_position = operation(Operations.queue_position)
+    chart_data = operation(Operations.chart_data)
+    task_version = operation(Operations.task_version)
+
+    # --- trade_logs ---
+
+    load_status = operation(Operations.load_status)
+    write_trades = operation(Operations.write_trades)
+    load_trades = operation(Operations.load_trades)
+    rebuild_rollups = operation(Operations.rebuild_rollups)
+    rollup_candles = operation(Operations.rollup_candles)
+
+    def iter_trade_chunks(self, task_id=None, start=None, end=None, chunk_size=EXPORT_CHUNK_ROWS):
+        """
+        Сделки задачи и/или окна по log_time пачками по chunk_size, по порядку (log_time, id);
+        кортежи (id, task_id, log_time, symbol, side, amount, pnl_change).
+        Базовая реализация – страницы по ключу (log_time, id): соединение держится
+        только на время одной пачки.
+        """
+        conditions, params = export_conditions(task_id, start, end)
+        last = None
+        while True:
+            page_conditions, page_params = list(conditions), list(params)
+            if last is not None:
+                page_conditions.append("(log_time > %s OR (log_time = %s AND id > %s))")
+                page_params += [last[2], last[2], last[0]]
+            conn = self.connection()
+            try:
+                cursor = conn.cursor(TUPLE_CURSOR)
+                cursor.execute(TRADES_EXPORT_QUERY.format(where=where_sql(page_conditions), limit=" LIMIT %s"),
+                               page_params + [chunk_size])
+                rows = cursor.fetchall()
+                cursor.close()
+            finally:
+                conn.close()
+            if rows:
+                yield rows
+            if len(rows) < chunk_size:
+                return
+            last = rows[-1]
+
+    # --- agent_leases ---
+
+    claim_leases = operation(Operations.claim_leases)
+    renew_leases = operation(Operations.renew_leases)
+    release_lease = operation(Operations.release_lease)
+    expire_leases = operation(Operations.expire_leases)
+
+
+class MySQLStorage(SQLStorage):
+    dialect = "mysql"
+
+    def __init__(self, connect_kwargs, **pool_kwargs):
+        self.pool = ConnectionPool(connect_kwargs, **pool_kwargs)
+
+    def _connect(self):
+        try:
+            return self.pool.acquire()
+        except Exception as e:
+            print(f"Ошибка подключения к MySQL: {e}")
+            raise StorageUnavailable(str(e)) from e
+
+    def stats(self):
+        return {"pool": self.pool.stats()}
+
+    def iter_trade_chunks(self, task_id=None, start=None, end=None, chunk_size=EXPORT_CHUNK_ROWS):
+        """Один запрос через небуферизованный серверный курсор (SSCursor), см. SQLStorage."""
+        conditions, params = export_conditions(task_id, start, end)
+        conn = self.connection()
+        finished = False
+        try:
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            cursor.execute(TRADES_EXPORT_QUERY.format(where=where_sql(conditions), limit=""), params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+            cursor.close()
+            finished = True
+        finally:
+            if finished:
+                conn.close()
+            else:
+                # Клиент ушёл посреди выгрузки: close() дочитал бы весь остаток результата
+                conn.discard()
+
+    def close(self):
+        self.pool.close_all()
+
+
+# SQLite хранит DATETIME как текст ISO, DECIMAL – как REAL
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+sqlite3.register_adapter(Decimal, float)
+sqlite3.register_converter("DATETIME", lambda value: datetime.fromisoformat(value.decode()))
+
+
+class _SQLiteCursor:
+    """
+    Курсор SQLite с плейсхолдерами %s и строками-словарями, как у DictCursor PyMySQL.
+    Результат SELECT буферизуется сразу (как у буферизованного курсора PyMySQL),
+    поэтому rowcount – число строк результата и для SELECT.
+    as_dict=False – строки-кортежи, как у pymysql.cursors.Cursor.
+    """
+
+    def __init__(self, raw, as_dict=True):
+        self._raw = raw
+        self._as_dict = as_dict
+        self._rows = None
+        self._pos = 0
+
+    @staticmethod
+    def _sql(query):
+        return query.replace("%s", "?")
+
+    def execute(self, query, params=None):
+        self._raw.execute(self._sql(query), params or ())
+        if self._raw.description is not None:
+            self._rows = self._raw.fetchall()
+            self._pos = 0
+        else:
+            self._rows = None
+        return self.rowcount
+
+    def executemany(self, query, seq_of_params):
+        self._rows = None
+        self._raw.executemany(self._sql(query), seq_of_params)
+        return self._raw.rowcount
+
+    def _row(self, row):
+        if row is None or not self._as_dict:
+            return row
+        return {col[0]: value for col, value in zip(self._raw.description, row)}
+
+    def fetchone(self):
+        if not self._rows or self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._row(self._rows[self._pos - 1])
+
+    def fetchall(self):
+        rows = self._rows[self._pos:] if self._rows else []
+        self._pos += len(rows)
+        return [self._row(row) for row in rows]
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    @property
+    def lastrowid(self):
+        return self._raw.lastrowid
+
+    @property
+    def rowcount(self):
+        if self._rows is not None:
+            return len(self._rows)
+        return self._raw.rowcount
+
+    def close(self):
+        self._rows = None
+        self._raw.close()
+
+
+class _SQLiteConnection:
+    """Эксклюзивный доступ к общему соединению SQLite до close()."""
+
+    def __init__(self, storage):
+        self._storage = storage
+        self._raw = storage._raw
+
+    def cursor(self, cursor_class=None):
+        return _SQLiteCursor(self._raw.cursor(), as_dict=cursor_class is not TUPLE_CURSOR)
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if self._raw is not None:
+            self._raw.rollback()
+            self._raw = None
+            self._storage._lock.release()
+
+
+class SQLiteStorage(SQLStorage):
+    """
+    Одно соединение на процесс, доступ сериализуется блокировкой:
+    для ":memory:" иначе нельзя (у каждого соединения своя база).
+    """
+    dialect = "sqlite"
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._raw = sqlite3.connect(path, check_same_thread=False,
+                                    detect_types=sqlite3.PARSE_DECLTYPES)
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._lock.acquire()
+        return _SQLiteConnection(self)
+
+    def close(self):
+        with self._lock:
+            self._raw.close()
+
+
+def create_storage():
+    """
+    Бэкенд хранилища выбирается переменной STORAGE_BACKEND:
+      mysql (по умолчанию) – пул соединений к DATABASE_CONFIG;
+      sqlite – файл SQLITE_PATH или база в памяти (локальные нагрузочные прогоны без сети).
+    """
+    if os.getenv("STORAGE_BACKEND", "mysql") == "sqlite":
+        return SQLiteStorage(os.getenv("SQLITE_PATH", ":memory:"))
+    # Пул соединений: размеры и времена жизни настраиваются через переменные окружения
+    return MySQLStorage(
+        DATABASE_CONFIG,
+        min_size=int(os.getenv("DB_POOL_MIN", "2")),
+        max_size=int(os.getenv("DB_POOL_MAX", "20")),
+        max_idle=int(os.getenv("DB_POOL_MAX_IDLE", "300")),
+        max_lifetime=int(os.getenv("DB_POOL_MAX_LIFETIME", "3600")),
+        timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    )
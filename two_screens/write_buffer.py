@@ -0,0 +1,165 @@
+"""
+Write-behind буфер сделок симулятора.
+
+Тики всех агентов складывают сделки в общий буфер, фоновый поток сбрасывает их
+пачками: один многострочный INSERT в trade_logs, одно агрегированное UPDATE tasks
+на задачу и один commit на пачку – вместо трёх запросов и commit на каждый тик.
+"""
+import threading
+import time
+from collections import Counter, deque
+
+
+class BufferFull(Exception):
+    """Буфер переполнен и не освободился за put_timeout (БД не успевает)."""
+
+
+class TradeWriteBuffer:
+    """
+      write          – write(rows, totals): запись пачки одной транзакцией (storage.write_trades);
+      flush_interval – сброс не реже, чем раз в столько секунд;
+      batch_size     – сброс сразу, как только накопилось столько сделок;
+      max_pending    – предел буфера: дальше add() ждёт (back-pressure) ...
+      put_timeout    – ... не дольше стольких секунд, потом BufferFull;
+      on_flush       – on_flush(task_ids): пачка записана (status_cache.invalidate_loads).
+    """
+
+    def __init__(self, write, flush_interval=1.0, batch_size=1000,
+                 max_pending=20000, put_timeout=5.0, on_flush=None):
+        self._write = write
+        self._on_flush = on_flush
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.put_timeout = put_timeout
+
+        self._rows = deque()
+        self._task_rows = Counter()  # task_id -> несохранённых сделок
+        self._write_seq = 0          # номер последней начатой записи пачки
+        self._writing = False        # пачка пишется: какие её сделки уже в БД – неизвестно
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="trade-writer", daemon=True)
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+        self.lost = 0
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, task_id, log_time, symbol, side, amount, pnl_change, fee):
+        deadline = time.monotonic() + self.put_timeout
+        with self._cond:
+            while len(self._rows) >= self.max_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BufferFull(f"В буфере {len(self._rows)} несохранённых сделок")
+                self._cond.wait(remaining)
+            self._rows.append((task_id, log_time, symbol, side, amount, pnl_change, fee))
+            self._task_rows[task_id] += 1
+            if len(self._rows) >= self.batch_size:
+                self._cond.notify_all()
+
+    def pending(self):
+        with self._cond:
+            return len(self._rows)
+
+    def pending_rows(self, task_id):
+        """
+        Сделки задачи, которых ещё нет в БД, по времени – ими дополняется снимок из БД:
+        (seq для written_since(), [(log_time, symbol, side, amount, pnl_change, fee), ...]).
+        None, пока пачка пишется.
+        """
+        with self._cond:
+            if self._writing:
+                return None
+            if task_id not in self._task_rows:
+                return self._write_seq, []
+            return self._write_seq, [row[1:] for row in self._rows if row[0] == task_id]
+
+    def written_since(self, seq):
+        """Начиналась ли запись пачки после pending_rows(): снимок БД мог захватить её сделки."""
+        with self._cond:
+            return self._writing or self._write_seq != seq
+
+    def close(self, timeout=30):
+        """Сбрасывает всё накопленное и останавливает поток (вызывается при завершении)."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        close_attempts = 0
+        while True:
+            with self._cond:
+                if not self._closed and len(self._rows) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if not self._rows:
+                    if self._closed:
+                        return
+                    continue
+                batch = [self._rows.popleft() for _ in range(min(self.batch_size, len(self._rows)))]
+                self._write_seq += 1
+                self._writing = True
+                # Освободилось место – будим производителей, ждущих в add()
+                self._cond.notify_all()
+
+            if self._flush(batch):
+                continue
+
+            with self._cond:
+                self._rows.extendleft(reversed(batch))
+                self._writing = False
+                if self._closed:
+                    close_attempts += 1
+                    if close_attempts >= 3:
+                        self.lost += len(self._rows)
+                        print(f"Не удалось сохранить {len(self._rows)} сделок при завершении")
+                        self._rows.clear()
+                        self._task_rows.clear()
+                        return
+            time.sleep(self.flush_interval)
+
+    def _flush(self, batch):
+        totals = {}
+        for task_id, _, _, _, _, pnl_change, fee in batch:
+            pnl_sum, fee_sum = totals.get(task_id, (0.0, 0.0))
+            totals[task_id] = (pnl_sum + pnl_change, fee_sum + fee)
+        try:
+            self._write([row[:6] for row in batch], totals)
+        except Exception as e:
+            self.failures += 1
+            print(f"Ошибка записи пачки сделок ({len(batch)} шт.): {e}")
+            return False
+        self.flushes += 1
+        self.rows_written += len(batch)
+        # Сначала on_flush, потом снятие счётчиков: загрузка в кэш, начатая до этой записи,
+        # уже не пройдёт (сверх проверки written_since)
+        if self._on_flush is not None:
+            try:
+                self._on_flush(totals.keys())
+            except Exception as e:
+                print(f"Ошибка обработки записанной пачки сделок: {e}")
+        with self._cond:
+            for task_id, _, _, _, _, _, _ in batch:
+                self._task_rows[task_id] -= 1
+                if not self._task_rows[task_id]:
+                    del self._task_rows[task_id]
+            self._writing = False
+        return True
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._rows)
+        return {
+            "pending": pending,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "rows_per_flush": round(self.rows_written / self.flushes, 1) if self.flushes else 0.0,
+            "failures": self.failures,
+            "lost": self.lost,
+        }